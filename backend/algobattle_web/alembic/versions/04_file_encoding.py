@@ -0,0 +1,23 @@
+"""Adds the storage encoding of files
+
+Revision ID: 8d3e1f6c2a47
+Revises: 591afb07e507
+Create Date: 2026-10-19 10:12:31.408126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "8d3e1f6c2a47"
+down_revision = "591afb07e507"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("files", sa.Column("encoding", sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("files", "encoding")
@@ -0,0 +1,23 @@
+"""Adds the size of files
+
+Revision ID: 2b7f90c4d3e1
+Revises: 8d3e1f6c2a47
+Create Date: 2026-10-19 11:03:52.117384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "2b7f90c4d3e1"
+down_revision = "8d3e1f6c2a47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("files", sa.Column("size", sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("files", "size")
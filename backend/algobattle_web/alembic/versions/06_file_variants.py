@@ -0,0 +1,26 @@
+"""Adds precomputed image variants of files
+
+Revision ID: c41a7e93b5d8
+Revises: 2b7f90c4d3e1
+Create Date: 2026-10-19 11:48:20.650231
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c41a7e93b5d8"
+down_revision = "2b7f90c4d3e1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("files", sa.Column("variants", sa.JSON(), nullable=True))
+    files = sa.table("files", sa.column("variants", sa.JSON()))
+    op.execute(files.update().values(variants=[]))
+    op.alter_column("files", "variants", existing_type=sa.JSON(), nullable=False)
+
+
+def downgrade() -> None:
+    op.drop_column("files", "variants")
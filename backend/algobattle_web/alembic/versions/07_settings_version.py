@@ -0,0 +1,23 @@
+"""Adds the version of the server settings
+
+Revision ID: 4e9b2d1f7a60
+Revises: c41a7e93b5d8
+Create Date: 2026-10-19 13:21:07.584410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4e9b2d1f7a60"
+down_revision = "c41a7e93b5d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("serversettingss", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade() -> None:
+    op.drop_column("serversettingss", "version")
@@ -0,0 +1,32 @@
+"""Adds indexes for the frequently run queries
+
+Revision ID: 9a5c3e71d2b4
+Revises: 4e9b2d1f7a60
+Create Date: 2026-10-19 14:02:41.118093
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9a5c3e71d2b4"
+down_revision = "4e9b2d1f7a60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_problems_tournament_start", "problems", ["tournament_id", "start"])
+    op.create_index(
+        "ix_programs_team_problem_role_time", "programs", ["team_id", "problem_id", "role", "creation_time"]
+    )
+    op.create_index("ix_scheduledmatches_time", "scheduledmatches", ["time"])
+    op.create_index("ix_matchresults_problem_time", "matchresults", ["problem_id", "time"])
+    op.create_index("ix_extrapoints_team_time", "extrapoints", ["team_id", "time"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_extrapoints_team_time", "extrapoints")
+    op.drop_index("ix_matchresults_problem_time", "matchresults")
+    op.drop_index("ix_scheduledmatches_time", "scheduledmatches")
+    op.drop_index("ix_programs_team_problem_role_time", "programs")
+    op.drop_index("ix_problems_tournament_start", "problems")
@@ -0,0 +1,72 @@
+"""Stores uuids as binary data on MySQL
+
+Revision ID: 3f8e6d20b915
+Revises: 9a5c3e71d2b4
+Create Date: 2026-10-19 14:48:12.402731
+
+"""
+from typing import Any
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3f8e6d20b915"
+down_revision = "9a5c3e71d2b4"
+branch_labels = None
+depends_on = None
+
+
+def _convert(is_uuid: Any, transit: str, convert: str, target: str) -> None:
+    """Converts all uuid columns, the foreign keys pointing at them are recreated afterwards."""
+    bind = op.get_bind()
+    if bind.dialect.name != "mysql":
+        return
+    inspector = sa.inspect(bind)
+    tables = [table for table in inspector.get_table_names() if table != "alembic_version"]
+    columns = {
+        table: [column for column in inspector.get_columns(table) if is_uuid(column["type"])] for table in tables
+    }
+    # MySQL names every foreign key, one without a name couldn't be dropped and recreated so it is left alone
+    foreign_keys = {
+        table: [(name, key) for key in inspector.get_foreign_keys(table) if (name := key["name"]) is not None]
+        for table in tables
+    }
+    for table, keys in foreign_keys.items():
+        for name, _ in keys:
+            op.drop_constraint(name, table, type_="foreignkey")
+    for table, cols in columns.items():
+        for column in cols:
+            # changing the type to binary keeps the stored bytes, which we then can convert in place
+            name, null = column["name"], "NULL" if column["nullable"] else "NOT NULL"
+            op.execute(f"ALTER TABLE `{table}` MODIFY `{name}` {transit} {null}")
+            op.execute(f"UPDATE `{table}` SET `{name}` = {convert.format(f'`{name}`')}")
+            op.execute(f"ALTER TABLE `{table}` MODIFY `{name}` {target} {null}")
+    for table, keys in foreign_keys.items():
+        for name, key in keys:
+            op.create_foreign_key(
+                name,
+                table,
+                key["referred_table"],
+                key["constrained_columns"],
+                key["referred_columns"],
+                **key.get("options", {}),
+            )
+
+
+def upgrade() -> None:
+    _convert(
+        lambda type: isinstance(type, sa.CHAR) and type.length == 32,
+        "VARBINARY(32)",
+        "UNHEX({})",
+        "BINARY(16)",
+    )
+
+
+def downgrade() -> None:
+    _convert(
+        lambda type: isinstance(type, sa.BINARY) and type.length == 16,
+        "VARBINARY(32)",
+        "LOWER(HEX({}))",
+        "CHAR(32)",
+    )
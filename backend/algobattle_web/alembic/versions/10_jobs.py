@@ -0,0 +1,52 @@
+"""Adds the background job queue
+
+Revision ID: 7c2d94e1a0f3
+Revises: 3f8e6d20b915
+Create Date: 2026-10-19 15:32:07.518264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from algobattle_web.util import BinaryUUID
+
+# revision identifiers, used by Alembic.
+revision = "7c2d94e1a0f3"
+down_revision = "3f8e6d20b915"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "jobs",
+        sa.Column("id", BinaryUUID(), nullable=False),
+        sa.Column(
+            "kind",
+            sa.Enum("page_data", "image_variants", "compress_files", "login_email", name="jobkind"),
+            nullable=False,
+        ),
+        sa.Column("args", sa.JSON(), nullable=False),
+        sa.Column("key", sa.String(256), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum("pending", "running", "complete", "failed", name="jobstatus"),
+            nullable=False,
+        ),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=False),
+        sa.Column("run_after", sa.DateTime(), nullable=False),
+        sa.Column("started", sa.DateTime(), nullable=True),
+        sa.Column("finished", sa.DateTime(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name="pk_jobs"),
+    )
+    op.create_index("ix_jobs_status_run_after", "jobs", ["status", "run_after"])
+    op.create_index("ix_jobs_key", "jobs", ["key"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_key", "jobs")
+    op.drop_index("ix_jobs_status_run_after", "jobs")
+    op.drop_table("jobs")
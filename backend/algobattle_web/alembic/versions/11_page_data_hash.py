@@ -0,0 +1,25 @@
+"""Adds the archive hash page data was computed from
+
+Revision ID: b85e0f3c6a29
+Revises: 7c2d94e1a0f3
+Create Date: 2026-10-19 16:05:43.270915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "b85e0f3c6a29"
+down_revision = "7c2d94e1a0f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("problems", sa.Column("file_hash", sa.String(64), nullable=True))
+    op.create_index("ix_problems_file_hash", "problems", ["file_hash"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_problems_file_hash", "problems")
+    op.drop_column("problems", "file_hash")
@@ -1,33 +1,59 @@
 "Module specifying the json api actions."
+from asyncio import iscoroutinefunction
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, timedelta
-from email.message import EmailMessage
 from enum import Enum, StrEnum
-from os import environ
-from smtplib import SMTP
-from typing import Annotated, Any, Callable, Literal, Self, Sequence, TypeVar
+from functools import wraps
+from itertools import chain
+from io import RawIOBase
+import json
+from types import UnionType
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    Literal,
+    Self,
+    Sequence,
+    TypeVar,
+    Union,
+    cast,
+    get_args,
+    get_origin,
+)
 from uuid import UUID
 from urllib.parse import quote
+from zipfile import ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
 from annotated_types import Interval
 
-from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile, Form, BackgroundTasks
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, UploadFile, Form, Header
+from fastapi.exceptions import ResponseValidationError
 from fastapi.routing import APIRoute
 from fastapi.dependencies.utils import get_typed_return_annotation
 from fastapi.datastructures import Default, DefaultPlaceholder
-from fastapi.responses import FileResponse
-from sqlalchemy import func, select
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import ColumnElement, Select, and_, func, literal, null, or_, select, union_all
 from sqlalchemy.exc import IntegrityError
-from pydantic import ByteSize, Field, WithJsonSchema, TypeAdapter
+from sqlalchemy.orm import InstrumentedAttribute, Load, selectinload
+from pydantic import BaseModel, ByteSize, Field, ValidationError, WithJsonSchema, TypeAdapter
 
 from algobattle.util import Role
 from algobattle_web import schemas
 from algobattle_web.models import (
+    BatchLoader,
     ExtraPoints,
     File as DbFile,
+    Job,
     ProblemPageData,
     ResultParticipant,
     ServerSettings,
     TeamSettings,
     UserSettings,
+    commit_async,
     encode,
     Session,
     ID,
@@ -38,21 +64,32 @@ from algobattle_web.models import (
     Program,
     ScheduledMatch,
     Team,
+    TeamRef,
     User,
 )
+from algobattle_web.cache import cached, response_cache
+from algobattle_web.database import PoolStats, RouteQueryStats, query_metrics
+from algobattle_web.jobs import enqueue, enqueue_login_emails
 from algobattle_web.util import (
+    AsyncSessionLocal,
     EmailConfig,
-    EnvConfig,
+    JobKind,
+    JobStatus,
     MatchStatus,
     SessionLocal,
+    StorageEncoding,
     ValueTaken,
+    accepts_encoding,
     unwrap,
     BaseSchema,
 )
 from algobattle_web.dependencies import (
+    AsyncDatabase,
+    AsyncPrincipal,
     CurrUser,
     Database,
     LoggedIn,
+    Loader,
     check_if_admin,
     get_db,
 )
@@ -88,7 +125,12 @@ SQL_LIMIT = 50
 
 
 class SchemaRoute(APIRoute):
-    """Route that defaults to using the `Schema` entry of the returned object as a response_model."""
+    """Route that defaults to using the `Schema` entry of the returned object as a response_model.
+
+    Responses are validated against the response model once, directly from the returned objects' attributes, and then
+    serialized straight to JSON by a precompiled type adapter. FastAPI's default path validates returned schemas again
+    and then converts them to JSON with `jsonable_encoder` and the standard library's encoder.
+    """
 
     def __init__(
         self, path: str, endpoint: Callable[..., Any], *, response_model: Any = Default(None), **kwargs: Any
@@ -97,7 +139,185 @@ class SchemaRoute(APIRoute):
             return_annotation = get_typed_return_annotation(endpoint)
             if hasattr(return_annotation, "Schema"):
                 response_model = return_annotation.Schema
-        super().__init__(path, endpoint, response_model=response_model, **kwargs)
+        self.response_adapter: TypeAdapter[Any] | None = None
+        self.cache_depends: frozenset[type] | None = getattr(endpoint, "cache_depends", None)
+        super().__init__(path, self._rendering(endpoint), response_model=response_model, **kwargs)
+        if self.response_model is not None:
+            self.response_adapter = TypeAdapter(self.response_model)
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+        if self.cache_depends is None:
+            return handler
+        return response_cache.wrap(self.unique_id, self.cache_depends, handler)  # type: ignore
+
+    def _rendering(self, endpoint: Callable[..., Any]) -> Callable[..., Any]:
+        if iscoroutinefunction(endpoint):
+
+            @wraps(endpoint)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                return self.render(await endpoint(*args, **kwargs))
+
+            return async_wrapper
+        else:
+
+            @wraps(endpoint)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                return self.render(endpoint(*args, **kwargs))
+
+            return wrapper
+
+    def render(self, content: Any) -> Any:
+        """Serializes the content returned by the endpoint into a JSON response."""
+        if self.response_adapter is None or isinstance(content, Response):
+            return content
+        try:
+            validated = self.response_adapter.validate_python(content, from_attributes=True)
+        except ValidationError as e:
+            raise ResponseValidationError(errors=e.errors(), body=content)
+        return Response(
+            self.response_adapter.dump_json(validated, by_alias=True),
+            status_code=self.status_code or 200,
+            media_type="application/json",
+        )
+
+
+class Keyset:
+    """Sort order of a paginated query.
+
+    Pages are identified by an opaque cursor containing the sort key of the last entry of the previous page. Since
+    the next page starts right after that key the database can find it via an index, without having to skip over
+    all previous entries like it does with offsets. The last key column has to be unique to make the order total.
+    """
+
+    def __init__(self, *keys: tuple[InstrumentedAttribute[Any], bool]) -> None:
+        self.keys = keys
+        self._values = TypeAdapter(tuple[tuple(column.type.python_type for column, _ in keys)])  # type: ignore
+
+    def order_by(self) -> list[ColumnElement[Any]]:
+        return [column.desc() if descending else column.asc() for column, descending in self.keys]
+
+    def after(self, cursor: str) -> ColumnElement[bool]:
+        """Filters the query to entries that come after the cursor."""
+        try:
+            values = self._values.validate_json(urlsafe_b64decode(cursor))
+        except (ValueError, ValidationError):
+            raise HTTPException(400, "Invalid cursor")
+        # bound explicitly so that boolean keys are compared like any other value
+        bound = [literal(value, column.type) for (column, _), value in zip(self.keys, values)]
+        clauses = []
+        for i, (column, descending) in enumerate(self.keys):
+            equal = [prev == value for (prev, _), value in zip(self.keys[:i], bound)]
+            clauses.append(and_(*equal, column < bound[i] if descending else column > bound[i]))
+        return or_(*clauses)
+
+    def cursor(self, obj: Any) -> str:
+        """The cursor of the page starting after this entry."""
+        values = tuple(getattr(obj, column.key) for column, _ in self.keys)
+        return urlsafe_b64encode(self._values.dump_json(values)).decode()
+
+    def paginate(
+        self, query: Select[Any], cursor: str | None, offset: int = 0, limit: int | None = SQL_LIMIT
+    ) -> Select[Any]:
+        """Selects the requested page, with one additional entry to determine whether there is a next page."""
+        if cursor is not None:
+            query = query.where(self.after(cursor))
+        query = query.order_by(*self.order_by()).offset(offset)
+        return query.limit(limit + 1) if limit is not None else query
+
+    def page(self, entries: Sequence[T], limit: int = SQL_LIMIT) -> tuple[Sequence[T], str | None]:
+        """Splits the fetched entries into the page's entries and the cursor of the next page."""
+        if len(entries) <= limit:
+            return entries, None
+        entries = entries[:limit]
+        return entries, self.cursor(entries[-1])
+
+
+def team_schema(option: Any) -> Any:
+    """Adds the loads needed to serialize the teams loaded by the option as `schemas.Team`."""
+    return option.options(selectinload(Team.tournament), selectinload(Team.members))
+
+
+def only_selected(entity: Any) -> Load:
+    """Makes relationships of the entity that no other option loads raise rather than query each object separately."""
+    return Load(entity).raiseload("*", sql_only=True)
+
+
+def _field_paths(spec: str) -> list[list[str]]:
+    """Splits a sparse fieldset like `results(time,participants.points),teams` into the paths of all fields."""
+    paths, groups, name = [], list[str](), ""
+    for char in spec + ",":
+        if char == "(":
+            groups.append(name)
+            name = ""
+        elif char in ",)":
+            if name:
+                paths.append(".".join([*groups, name]).split("."))
+            name = ""
+            if char == ")":
+                if not groups:
+                    raise HTTPException(400, "Unbalanced parentheses in the field selection")
+                groups.pop()
+        else:
+            name += char.strip()
+    if groups:
+        raise HTTPException(400, "Unbalanced parentheses in the field selection")
+    return paths
+
+
+def _nested_include(annotation: Any, path: list[str]) -> Any:
+    """Include specification for the selected path inside a value of the given type."""
+    if not path:
+        return True
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin is Annotated:
+        return _nested_include(args[0], path)
+    if origin in (Union, UnionType):
+        for arg in args:
+            if arg is not type(None):
+                return _nested_include(arg, path)
+    if origin in (list, set, tuple):
+        return {"__all__": _nested_include(args[0], path)}
+    if origin is dict:
+        return {"__all__": _nested_include(args[1], path)}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        computed = annotation.__pydantic_decorators__.computed_fields
+        if path[0] in annotation.model_fields:
+            field_type = annotation.model_fields[path[0]].annotation
+        elif path[0] in computed:
+            field_type = computed[path[0]].info.return_type
+        else:
+            raise HTTPException(400, f"There is no field named {path[0]}")
+        return {path[0]: _nested_include(field_type, path[1:])}
+    raise HTTPException(400, f"{path[0]} is not a field of a nested object")
+
+
+def _merge_include(first: Any, second: Any) -> Any:
+    if first is True or second is True:
+        return True
+    merged = dict(first)
+    for key, value in second.items():
+        merged[key] = _merge_include(merged[key], value) if key in merged else value
+    return merged
+
+
+def sparse_fields(model: type[BaseModel], spec: str) -> dict[str, Any]:
+    """Parses a sparse fieldset into the pydantic `include` specification of the response model.
+
+    The fieldset is a comma separated list of field names, dots select fields of nested objects and parentheses
+    group several fields of the same object. Fields of the entries of lists and dicts are selected like the fields
+    of plain nested objects.
+    """
+    include: Any = {}
+    for path in _field_paths(spec):
+        include = _merge_include(include, _nested_include(model, path))
+    return include
+
+
+def respond(data: BaseModel, fields: str | None) -> Response:
+    """Serializes the response data, only including the requested fields."""
+    include = sparse_fields(type(data), fields) if fields else None
+    return Response(data.model_dump_json(include=include), media_type="application/json")
 
 
 router = APIRouter(prefix="/api", route_class=SchemaRoute)
@@ -109,18 +329,285 @@ admin = APIRouter(prefix="/admin", dependencies=[Depends(check_if_admin)], route
 # *******************************************************************************
 
 
-@router.get("/files/{id}", tags=["files"])
-def get_file(db: Database, *, id: ID) -> FileResponse:
-    file = unwrap(db.get(DbFile, id))
-    return FileResponse(
-        file.path,
-        status_code=200 if file.path.exists() else 404,
-        filename=file.filename,
-        content_disposition_type="inline" if file.media_type == "application/pdf" else "attachment",
-        media_type=file.media_type,
+@router.get("/files/{id}", tags=["files"], response_class=FileResponse)
+async def get_file(
+    db: AsyncDatabase, *, id: ID, variant: str | None = None, accept_encoding: Annotated[str | None, Header()] = None
+) -> Response:
+    file = unwrap(await db.get(DbFile, id))
+    if variant is not None:
+        if variant not in file.variants:
+            raise HTTPException(404, "No such variant exists")
+        return FileResponse(
+            await run_in_threadpool(file.variant_path, variant),
+            filename=f"{file.filename.rsplit('.', 1)[0]}.webp",
+            content_disposition_type="inline",
+            media_type="image/webp",
+        )
+    disposition = "inline" if file.media_type == "application/pdf" else "attachment"
+    encoding = cast(StorageEncoding | None, file.encoding)
+    # the storage may need to access the network or move files, which we don't want to block the event loop
+    if not await run_in_threadpool(file.exists):
+        raise HTTPException(404, "The file's contents are missing")
+    if encoding is None or accepts_encoding(accept_encoding, encoding):
+        # compressed files can be sent as is if the client will decode them
+        return FileResponse(
+            await run_in_threadpool(lambda: file.path),
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"} if encoding else None,
+            filename=file.filename,
+            content_disposition_type=disposition,
+            media_type=file.media_type,
+        )
+    else:
+        return StreamingResponse(
+            iterate_file(file),
+            headers={
+                "Content-Disposition": f"{disposition}; filename*=utf-8''{quote(file.filename)}",
+                "Vary": "Accept-Encoding",
+            },
+            media_type=file.media_type,
+        )
+
+
+def iterate_file(file: DbFile, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yields the decompressed contents of a file in chunks."""
+    with file.open() as source:
+        while chunk := source.read(chunk_size):
+            yield chunk
+
+
+class _ZipSink(RawIOBase):
+    """Unseekable stream collecting the data written by a `ZipFile` until it is sent to the client."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iterate_zip(files: Iterable[tuple[str, DbFile]], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yields a zip archive containing the given files under the given names in chunks.
+
+    The archive is created while it is being sent, so neither it nor any of the files are held in memory entirely.
+    """
+    sink = _ZipSink()
+    with ZipFile(sink, "w") as archive:
+        for name, file in files:
+            info = ZipInfo(name, file.timestamp.timetuple()[:6])
+            # files with a storage encoding are the ones that compress well
+            info.compress_type = ZIP_DEFLATED if file.encoding else ZIP_STORED
+            # files stored before their size was recorded might be too large for regular entries
+            zip64 = file.size is None or file.size > ZIP64_LIMIT
+            with file.open() as source, archive.open(info, "w", force_zip64=zip64) as target:
+                while chunk := source.read(chunk_size):
+                    target.write(chunk)
+                    yield sink.pop()
+    yield sink.pop()
+
+
+def _archive_name(name: str) -> str:
+    return name.replace("/", "_").replace("\\", "_")
+
+
+def _problem_folder(problem: Problem) -> str:
+    # problem names are only unique within their tournament
+    return f"{_archive_name(problem.tournament.name)}/{_archive_name(problem.name)}"
+
+
+def _unique_path(folder: str, name: str, extension: str | None, taken: set[str]) -> str:
+    """Joins the parts into a path that isn't in `taken` yet, different names can be the same once made archive safe."""
+    suffix = f".{extension}" if extension is not None else ""
+    path = f"{folder}/{name}{suffix}"
+    counter = 1
+    while path in taken:
+        counter += 1
+        path = f"{folder}/{name} ({counter}){suffix}"
+    taken.add(path)
+    return path
+
+
+class ExportKind(StrEnum):
+    reports = "reports"
+    programs = "programs"
+
+
+@admin.get("/files/export/{kind}", tags=["files"], name="export", response_class=StreamingResponse)
+def export_files(
+    *, db: Database, kind: ExportKind, problem: ID | None = None, tournament: ID | None = None
+) -> StreamingResponse:
+    files: list[tuple[str, DbFile]] = []
+    taken: set[str] = set()
+    match kind:
+        case ExportKind.reports:
+            filters = []
+            if problem is not None:
+                filters.append(Report.problem_id == problem)
+            if tournament is not None:
+                filters.append(Report.problem.has(Problem.tournament_id == tournament))
+            reports = (
+                select(Report)
+                .where(*filters)
+                .options(
+                    selectinload(Report.problem).selectinload(Problem.tournament),
+                    selectinload(Report.team),
+                    selectinload(Report.file),
+                )
+            )
+            for report in db.scalars(reports).unique():
+                path = _unique_path(
+                    _problem_folder(report.problem), _archive_name(report.team.name), report.file.extension, taken
+                )
+                files.append((path, report.file))
+        case ExportKind.programs:
+            filters = []
+            if problem is not None:
+                filters.append(Program.problem_id == problem)
+            if tournament is not None:
+                filters.append(Program.problem.has(Problem.tournament_id == tournament))
+            latest = (
+                select(
+                    Program.id,
+                    func.row_number()
+                    .over(
+                        partition_by=(Program.team_id, Program.problem_id, Program.role),
+                        order_by=Program.creation_time.desc(),
+                    )
+                    .label("rank"),
+                )
+                .where(*filters)
+                .subquery()
+            )
+            programs = db.scalars(
+                select(Program)
+                .join(latest, latest.c.id == Program.id)
+                .where(latest.c.rank == 1)
+                .options(
+                    selectinload(Program.problem).selectinload(Problem.tournament),
+                    selectinload(Program.team),
+                    selectinload(Program.file),
+                )
+            )
+            for program in programs.unique():
+                folder = f"{_problem_folder(program.problem)}/{_archive_name(program.team.name)}"
+                path = _unique_path(folder, program.role.value, program.file.extension, taken)
+                files.append((path, program.file))
+    return StreamingResponse(
+        iterate_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={kind.value}.zip"},
+    )
+
+
+@admin.post("/files/compress", tags=["files"])
+def compress_files(*, db: Database) -> Job:
+    job = enqueue(db, JobKind.compress_files)
+    db.commit()
+    return job
+
+
+class StorageUsage(BaseSchema):
+    total: int
+    tournaments: dict[ID, int]
+    teams: dict[ID, int]
+
+
+@admin.get("/files/usage", tags=["files"], name="storageUsage")
+def storage_usage(*, db: Database) -> StorageUsage:
+    owners = union_all(
+        select(Program.team_id, Team.tournament_id, Program.file_id).join(Team, Program.team_id == Team.id),
+        select(Report.team_id, Team.tournament_id, Report.file_id).join(Team, Report.team_id == Team.id),
+        select(null(), Problem.tournament_id, Problem.file_id),
+        select(null(), Problem.tournament_id, Problem.image_id).where(Problem.image_id.is_not(None)),
+        select(null(), Problem.tournament_id, MatchResult.logs_id)
+        .join(Problem, MatchResult.problem_id == Problem.id)
+        .where(MatchResult.logs_id.is_not(None)),
+    ).subquery()
+    team_id, tournament_id, file_id = owners.c
+    size = func.coalesce(func.sum(DbFile.size), 0)
+    teams = db.execute(
+        select(team_id, size).join(DbFile, DbFile.id == file_id).where(team_id.is_not(None)).group_by(team_id)
+    )
+    tournaments = db.execute(select(tournament_id, size).join(DbFile, DbFile.id == file_id).group_by(tournament_id))
+    return StorageUsage(
+        total=db.scalar(select(func.coalesce(func.sum(DbFile.size), 0))) or 0,
+        tournaments={id: total for id, total in tournaments},
+        teams={id: total for id, total in teams},
+    )
+
+
+class DatabasePools(BaseSchema):
+    engine: PoolStats | None
+    async_engine: PoolStats | None
+
+
+@admin.get("/database/pools", tags=["database"], name="poolStats")
+async def pool_stats() -> DatabasePools:
+    engine, async_engine = SessionLocal.kw.get("bind"), AsyncSessionLocal.kw.get("bind")
+    return DatabasePools(
+        engine=PoolStats.of(engine.pool) if engine else None,
+        async_engine=PoolStats.of(async_engine.sync_engine.pool) if async_engine else None,
     )
 
 
+@admin.get("/database/queries", tags=["database"], name="queryStats")
+async def query_stats() -> dict[str, RouteQueryStats]:
+    """Number of queries and time spent in the database per route, sorted by the total time."""
+    routes = sorted(query_metrics.snapshot().items(), key=lambda item: item[1].time, reverse=True)
+    return {route: RouteQueryStats.of(queries) for route, queries in routes}
+
+
+@admin.delete("/database/queries", tags=["database"], name="resetQueryStats")
+async def reset_query_stats() -> None:
+    query_metrics.reset()
+
+
+@admin.get("/jobs", tags=["jobs"], name="get")
+def get_jobs(
+    *,
+    db: Database,
+    status: JobStatus | None = None,
+    kind: JobKind | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+) -> dict[ID, schemas.Job]:
+    """The most recently created background jobs."""
+    filters = []
+    if status is not None:
+        filters.append(Job.status == status)
+    if kind is not None:
+        filters.append(Job.kind == kind)
+    jobs = db.scalars(select(Job).where(*filters).order_by(Job.created.desc()).limit(limit)).all()
+    return encode(jobs)
+
+
+@admin.get("/jobs/{id}", tags=["jobs"], name="getOne")
+def get_job(*, db: Database, id: ID) -> Job:
+    return unwrap(db.get(Job, id))
+
+
+@admin.post("/jobs/{id}/retry", tags=["jobs"], name="retry")
+def retry_job(*, db: Database, id: ID) -> Job:
+    """Runs a failed job again."""
+    job = unwrap(db.get(Job, id))
+    if job.status != JobStatus.failed:
+        raise HTTPException(400, "Only failed jobs can be retried")
+    job.status = JobStatus.pending
+    job.max_attempts = job.attempts + 1
+    job.run_after = datetime.now()
+    job.finished = None
+    db.commit()
+    return job
+
+
 # *******************************************************************************
 # * User
 # *******************************************************************************
@@ -129,7 +616,11 @@ def get_file(db: Database, *, id: ID) -> FileResponse:
 class UserSearch(BaseSchema):
     users: dict[ID, schemas.User]
     teams: dict[ID, schemas.Team]
-    total: int
+    total: int | None
+    next_cursor: str | None = None
+
+
+user_order = Keyset((User.is_admin, True), (User.name, False), (User.id, False))
 
 
 @admin.get("/user", tags=["user"])
@@ -143,6 +634,8 @@ def search_users(
     tournament: ID | None = None,
     team: ID | None = None,
     offset: int = 0,
+    cursor: str | None = None,
+    count: bool = True,
     exact_search: bool = False,
 ) -> UserSearch:
     filters: list[Any] = []
@@ -164,19 +657,24 @@ def search_users(
         filters.append(User.teams.any(Team.tournament_id == tournament))
     if team is not None:
         filters.append(User.teams.any(Team.id == team))
-    users = (
+    users, next_cursor = user_order.page(
         db.scalars(
-            select(User).where(*filters).order_by(User.is_admin.desc(), User.name.asc()).limit(SQL_LIMIT).offset(offset)
+            user_order.paginate(
+                select(User).where(*filters).options(team_schema(selectinload(User.teams)), only_selected(User)),
+                cursor,
+                offset,
+            )
         )
         .unique()
         .all()
     )
-    user_count = db.scalar(select(func.count()).select_from(User).where(*filters)) or 0
+    user_count = db.scalar(select(func.count()).select_from(User).where(*filters)) or 0 if count else None
     teams = [team for user in users for team in user.teams]
     return UserSearch(
         users=encode(users),
         teams=encode(teams),
         total=user_count,
+        next_cursor=next_cursor,
     )
 
 
@@ -188,8 +686,8 @@ class CreateUser(BaseSchema):
 
 
 @admin.post("/user", tags=["user"])
-def create_user(*, db: Session = Depends(get_db), user: CreateUser) -> User:
-    _teams = [unwrap(db.get(Team, id)) for id in user.teams]
+def create_user(*, db: Session = Depends(get_db), loader: Loader, user: CreateUser) -> User:
+    _teams = loader.get_all(Team, user.teams)
     if db.scalars(select(User).filter(User.email == user.email)).unique().first() is not None:
         raise ValueTaken("email", user.email)
     new = User(email=user.email, name=user.name, is_admin=user.is_admin, teams=_teams)
@@ -211,14 +709,14 @@ class EditUser(BaseSchema):
 
 
 @admin.patch("/user/{id}", tags=["user"])
-def edit_user(*, db: Session = Depends(get_db), id: ID, edit: EditUser) -> User:
+def edit_user(*, db: Session = Depends(get_db), loader: Loader, id: ID, edit: EditUser) -> User:
     user = unwrap(User.get(db, id))
 
     for key, val in edit.model_dump(exclude_unset=True).items():
         if key != "teams":
             setattr(user, key, val)
-    for id, action in edit.teams.items():
-        team = unwrap(db.get(Team, id))
+    teams = loader.get_all(Team, edit.teams)
+    for team, action in zip(teams, edit.teams.values()):
         match action:
             case EditAction.add if team not in user.teams:
                 user.teams.append(team)
@@ -244,55 +742,54 @@ def delete_user(*, db: Session = Depends(get_db), id: ID) -> bool:
     return True
 
 
+@admin.post("/user/login_links", tags=["user"], name="sendLoginLinks")
+def send_login_links(
+    *, db: Database, team: InBody[ID | None] = None, tournament: InBody[ID | None] = None, target_url: InBody[str]
+) -> int:
+    """Emails login links to the members of the team or tournament and returns how many users will get one."""
+    filters = []
+    if team is not None:
+        filters.append(Team.id == team)
+    if tournament is not None:
+        filters.append(Team.tournament_id == tournament)
+    if not filters:
+        raise HTTPException(400, "Either a team or a tournament needs to be selected")
+    users = db.scalars(select(User.id).join(User.teams).where(*filters).distinct()).all()
+    enqueue_login_emails(db, users, target_url)
+    db.commit()
+    return len(users)
+
+
 class LoginInfo(BaseSchema):
     user: schemas.UserLogin | None
     team: schemas.Team | Literal["admin"] | None
     tournament: schemas.Tournament | None
 
 
-@router.get("/user/login", tags=["user"], name="getLogin", response_model=LoginInfo)
-def get_self(*, db: Database, login: LoggedIn) -> LoggedIn:
-    if login.user is not None:
-        if login.user.is_admin and login.user.settings.selected_tournament is None:
-            login.user.settings.selected_tournament = db.scalars(
-                select(Tournament).order_by(Tournament.time.desc())
-            ).first()
-        if login.team is None and login.user.teams:
-            login.user.settings.selected_team = login.user.teams[0]
+@router.get("/user/login", tags=["user"], name="getLogin")
+def get_self(*, db: Database, login: LoggedIn) -> LoginInfo:
+    user = login.user
+    if user is not None:
+        if user.is_admin and user.settings.selected_tournament is None:
+            user.settings.selected_tournament = db.scalars(select(Tournament).order_by(Tournament.time.desc())).first()
+        if login.team is None and user.teams:
+            user.settings.selected_team = user.teams[0]
         db.commit()
-    return login
+    return LoginInfo.model_validate(
+        {
+            "user": user,
+            "team": user.logged_in if user else None,
+            "tournament": user.tournament if user else None,
+        }
+    )
 
 
 @router.post("/user/login", tags=["user"])
-def login(*, db: Database, email: str = Body(), target_url: InBody[str], tasks: BackgroundTasks) -> None:
+def login(*, db: Database, email: str = Body(), target_url: InBody[str]) -> None:
     user = User.get(db, email)
     if user is not None:
-        tasks.add_task(send_login_email, user.id, target_url)
-
-
-def send_login_email(user_id: UUID, target_url: str) -> None:
-    with SessionLocal() as db:
-        user = db.get(User, user_id)
-        if not user:
-            return
-        token = user.login_token(db)
-        url = str(EnvConfig.get().base_url) + target_url + f"?login_token={token}"
-        if environ.get("DEV"):
-            print(f"sending email to {user.email}: {url}")
-            return
-        config = ServerSettings.get(db).email_config
-        msg = EmailMessage()
-        msg["Subject"] = "Algobattle login"
-        msg["From"] = config.address
-        msg["To"] = user.email
-        msg.set_content(url)
-
-        server = SMTP(config.server, config.port)
-        server.ehlo()
-        server.starttls()
-        server.login(config.username, config.password)
-        server.sendmail(config.username, user.email, msg.as_string())
-        server.close()
+        enqueue_login_emails(db, [user.id], target_url)
+        db.commit()
 
 
 class TokenData(BaseSchema):
@@ -330,7 +827,7 @@ def edit_user_settings(
     if user is None:
         raise HTTPException(400, "Not logged in")
     if email is not None and email != user.email:
-        if not ServerSettings.get(db).user_change_email:
+        if not ServerSettings.cached(db).user_change_email:
             raise HTTPException(400, "Users cannot change their own email")
         if db.scalar(select(User).where(User.email == email, User.id != user.id)):
             raise ValueTaken("email", email)
@@ -352,19 +849,19 @@ def edit_user_settings(
 
 @router.get("/settings/team", tags=["settings"], name="getTeam")
 def get_team_settings(*, db: Database, login: LoggedIn) -> TeamSettings:
-    team = login.team
-    if not isinstance(team, Team):
+    team = login.team_model
+    if team is None:
         raise HTTPException(400, "User has not selected a team")
     return team.settings
 
 
 @router.patch("/settings/team", tags=["settings"], name="editTeam")
 def edit_team_settings(*, db: Database, login: LoggedIn, name: InBody[str32 | None] = None) -> None:
-    team = login.team
-    if not isinstance(team, Team):
+    team = login.team_model
+    if team is None:
         raise HTTPException(400, "User has not selected a team")
     if name is not None and name != team.name:
-        if not ServerSettings.get(db).team_change_name:
+        if not ServerSettings.cached(db).team_change_name:
             raise HTTPException(400, "Teams cannot change their own name")
         if db.scalar(
             select(Team).where(Team.tournament_id == team.tournament_id, Team.name == name, Team.id != team.id)
@@ -377,9 +874,9 @@ def edit_team_settings(*, db: Database, login: LoggedIn, name: InBody[str32 | No
 @router.get("/settings/server", tags=["settings"], name="getServer")
 def get_server_settings(*, db: Database, login: LoggedIn) -> schemas.ServerSettings | schemas.AdminServerSettings:
     if login.team == "admin":
-        return schemas.AdminServerSettings.model_validate(ServerSettings.get(db))
+        return schemas.AdminServerSettings.model_validate(ServerSettings.cached(db))
     else:
-        return schemas.ServerSettings.model_validate(ServerSettings.get(db))
+        return schemas.ServerSettings.model_validate(ServerSettings.cached(db))
 
 
 @admin.patch("/settings/server", tags=["settings"], name="editServer")
@@ -406,8 +903,9 @@ def edit_server_settings(
 
 
 @router.get("/settings/home", tags=["settings"])
+@cached(ServerSettings)
 def home(db: Database) -> str | None:
-    return ServerSettings.get(db).home_page_compiled
+    return ServerSettings.cached(db).home_page_compiled
 
 
 # *******************************************************************************
@@ -416,6 +914,7 @@ def home(db: Database) -> str | None:
 
 
 @router.get("/tournament", tags=["tournament"], name="get")
+@cached(Tournament)
 def all_tournaments(
     *, db: Database, login: LoggedIn, name: str | None = None, id: ID | None = None
 ) -> dict[ID, schemas.Tournament]:
@@ -482,17 +981,22 @@ class ScoreData(BaseSchema):
 
 
 @router.get("/tournament/{id}/scores/", tags=["tournament"], name="getScores")
+@cached(Tournament, Team, Problem, DbFile, MatchResult, ResultParticipant, ExtraPoints)
 def get_scores(db: Database, login: LoggedIn, id: ID) -> ScoreData:
     tournament = Tournament.get_unwrap(db, id)
     tournament.assert_visible(login.team)
+    # filtering with IN lets the database look the rows up by problem/team rather than checking every row
     results = db.scalars(
         select(MatchResult).where(
-            MatchResult.problem.has(Problem.tournament_id == tournament.id),
+            MatchResult.problem_id.in_(select(Problem.id).where(Problem.tournament_id == tournament.id)),
             MatchResult.participants.any(ResultParticipant.points != 0),
         )
+        .options(selectinload(MatchResult.participants), only_selected(MatchResult))
     ).all()
     extra_points = db.scalars(
-        select(ExtraPoints).where(ExtraPoints.team.has(Team.tournament_id == tournament.id))
+        select(ExtraPoints)
+        .where(ExtraPoints.team_id.in_(select(Team.id).where(Team.tournament_id == tournament.id)))
+        .options(only_selected(ExtraPoints))
     ).all()
 
     parsed_results = [
@@ -500,9 +1004,11 @@ def get_scores(db: Database, login: LoggedIn, id: ID) -> ScoreData:
         for r in results
     ]
     parsed_extra = [ExtraEvent(time=e.time, points={e.team_id: e.points}) for e in extra_points]
-    teams = db.scalars(select(Team).where(Team.tournament_id == tournament.id)).unique().all()
+    teams = db.scalars(select(Team).where(Team.tournament_id == tournament.id).options(only_selected(Team))).unique().all()
     problems = db.scalars(
-        select(Problem).where(Problem.tournament_id == tournament.id, Problem.visible_sql(login.team))
+        select(Problem)
+        .where(Problem.tournament_id == tournament.id, Problem.visible_sql(login.team))
+        .options(selectinload(Problem.tournament))
     ).unique().all()
     return ScoreData(
         events=sorted(parsed_results + parsed_extra, key=lambda e: e.time),
@@ -517,9 +1023,13 @@ def get_scores(db: Database, login: LoggedIn, id: ID) -> ScoreData:
 
 
 class TeamSearch(BaseSchema):
-    total: int
+    total: int | None
     teams: dict[ID, schemas.Team]
     users: dict[ID, schemas.User]
+    next_cursor: str | None = None
+
+
+team_order = Keyset((Team.tournament_id, False), (Team.name, False), (Team.id, False))
 
 
 @admin.get("/team", tags=["team"], name="get")
@@ -530,6 +1040,8 @@ def get_teams(
     name: str | None = None,
     tournament: ID | None = None,
     offset: int = 0,
+    cursor: str | None = None,
+    count: bool = True,
 ) -> TeamSearch:
     filters = []
     if ids:
@@ -538,32 +1050,41 @@ def get_teams(
         filters.append(Team.name.contains(name, autoescape=True))
     if tournament is not None:
         filters.append(Team.tournament_id == tournament)
-    teams = (
+    teams, next_cursor = team_order.page(
         db.scalars(
-            select(Team)
-            .where(*filters)
-            .order_by(Team.tournament_id.asc(), Team.name.asc())
-            .limit(SQL_LIMIT)
-            .offset(offset)
+            team_order.paginate(
+                select(Team)
+                .where(*filters)
+                .options(
+                    selectinload(Team.tournament),
+                    selectinload(Team.members).selectinload(User.teams),
+                    only_selected(Team),
+                ),
+                cursor,
+                offset,
+            )
         )
         .unique()
         .all()
     )
-    team_count = db.scalar(select(func.count()).select_from(Team).where(*filters)) or 0
+    team_count = db.scalar(select(func.count()).select_from(Team).where(*filters)) or 0 if count else None
     users = [user for team in teams for user in team.members]
     return TeamSearch(
         total=team_count,
         teams=encode(teams),
         users=encode(users),
+        next_cursor=next_cursor,
     )
 
 
 @admin.post("/team", tags=["team"], name="create")
-def create_team(*, db: Database, name: str32, tournament: InBody[ID], members: InBody[set[ID]]) -> Team:
+def create_team(
+    *, db: Database, loader: Loader, name: str32, tournament: InBody[ID], members: InBody[set[ID]]
+) -> Team:
     tournament_ = unwrap(Tournament.get(db, tournament))
     if name in (t.name for t in tournament_.teams):
         raise ValueTaken("name", name)
-    members_ = [unwrap(db.get(User, id)) for id in members]
+    members_ = loader.get_all(User, members)
     team_ = Team(name, tournament_, members_)
     db.add(team_)
     db.commit()
@@ -574,6 +1095,7 @@ def create_team(*, db: Database, name: str32, tournament: InBody[ID], members: I
 def edit_team(
     *,
     db: Database,
+    loader: Loader,
     id: ID,
     name: str32 | None = None,
     tournament: InBody[ID | None] = None,
@@ -584,8 +1106,8 @@ def edit_team(
         team.name = name
     if tournament is not None:
         team.tournament_id = tournament
-    for id, action in members.items():
-        user = unwrap(db.get(User, id))
+    users = loader.get_all(User, members)
+    for user, action in zip(users, members.values()):
         match action:
             case EditAction.add if user not in team.members:
                 team.members.append(user)
@@ -615,10 +1137,11 @@ def delete_team(*, db: Database, id: ID):
 
 
 @router.get("/problem", tags=["problem"], name="get")
-def get_problems(
+@cached(Problem, Tournament, DbFile)
+async def get_problems(
     *,
-    db: Database,
-    login: LoggedIn,
+    db: AsyncDatabase,
+    login: AsyncPrincipal,
     ids: list[ID] | None = None,
     name: str | None = None,
     tournament: ID | None = None,
@@ -633,11 +1156,15 @@ def get_problems(
         filters.append(Problem.id.in_(ids))
     if name:
         filters.append(Problem.name == name)
-    problems = db.scalars(select(Problem).where(*filters, Problem.visible_sql(login.team))).unique().all()
-    return encode(problems)
+    team = login.logged_in if login else None
+    problems = await db.scalars(
+        select(Problem).where(*filters, Problem.visible_sql(team)).options(selectinload(Problem.tournament))
+    )
+    return encode(problems.unique().all())
 
 
 @router.get("/problem/pagedata", tags=["problem"], name="pageData")
+@cached(Problem)
 def get_problem_page_data(*, db: Database, login: LoggedIn, id: ID) -> ProblemPageData | None:
     prob = db.scalars(select(Problem).where(Problem.id == id, Problem.visible_sql(login.team))).first()
     if prob is None:
@@ -658,20 +1185,17 @@ def create_problem(
     alt_text: str = Form(""),
     description: str = Form(""),
     color: str = Form("#ffffff"),
-    background_tasks: BackgroundTasks,
 ) -> str:
-    _tournament = unwrap(db.get(Tournament, tournament))
+    _tournament = Tournament.get_unwrap(db, tournament)
     _image = DbFile.maybe(image, alt_text=alt_text)
-    limit = ServerSettings.get(db).upload_file_limit
+    limit = ServerSettings.cached(db).upload_file_limit
     if isinstance(problem, UUID):
-        template_prob = unwrap(db.get(Problem, problem))
+        template_prob = Problem.get_unwrap(db, problem)
         file = DbFile.from_file(template_prob.file.path, action="copy")
-        page_data = template_prob.page_data
     else:
         if problem.size and problem.size > limit:
             raise ValueError
         file = DbFile.from_file(problem)
-        page_data = None
     if db.scalars(select(Problem).where(Problem.name == name, Problem.tournament_id == tournament)).first():
         raise ValueTaken("name", name)
     if image is not None and image.size and image.size > limit:
@@ -686,12 +1210,13 @@ def create_problem(
         image=_image,
         description=description,
         colour=color,
-        page_data=page_data,
     )
     db.add(prob)
+    if prob.use_file(db, file):
+        enqueue(db, JobKind.page_data, problem=prob.id)
+    if prob.image is not None:
+        enqueue(db, JobKind.image_variants, file=prob.image.id)
     db.commit()
-    if page_data is None:
-        background_tasks.add_task(prob.compute_page_data)
     return f"/problems/{quote(prob.tournament.name, safe='')}/{quote(prob.name, safe='')}"
 
 
@@ -709,9 +1234,8 @@ def edit_problem(
     colour: InForm[str | None] = None,
     file: UploadFile | None = None,
     image: UploadFile | InForm[Remove] | None = None,
-    tasks: BackgroundTasks,
 ) -> Problem:
-    problem = unwrap(db.get(Problem, id))
+    problem = Problem.get_unwrap(db, id)
     if name:
         new_tournament = tournament or problem.tournament_id
         if db.scalar(
@@ -720,7 +1244,7 @@ def edit_problem(
             raise ValueTaken("name", name)
         problem.name = name
     if tournament:
-        problem.tournament = unwrap(db.get(Tournament, tournament))
+        problem.tournament = Tournament.get_unwrap(db, tournament)
     if start is not None:
         problem.start = Remove.convert(start)
     if end is not None:
@@ -732,22 +1256,25 @@ def edit_problem(
     if colour:
         problem.colour = colour
     if file:
-        if file.size and ServerSettings.get(db).upload_file_limit < file.size:
+        if file.size and ServerSettings.cached(db).upload_file_limit < file.size:
             raise ValueError
-        problem.file = DbFile.from_file(file)
-        tasks.add_task(problem.compute_page_data)
+        if problem.use_file(db, DbFile.from_file(file)):
+            enqueue(db, JobKind.page_data, problem=problem.id)
     if image is not None:
         image = Remove.convert(image)
-        if image is not None and image.size and ServerSettings.get(db).upload_file_limit < image.size:
+        if image is not None and image.size and ServerSettings.cached(db).upload_file_limit < image.size:
             raise ValueError
-        problem.image = DbFile.maybe(image)
+        new_image = DbFile.maybe(image)
+        problem.image = new_image
+        if new_image is not None:
+            enqueue(db, JobKind.image_variants, file=new_image.id)
     db.commit()
     return problem
 
 
 @admin.delete("/problem/{id}", tags=["problem"], name="delete")
 def delete_problem(*, db: Database, id: ID) -> bool:
-    problem = unwrap(db.get(Problem, id))
+    problem = Problem.get_unwrap(db, id)
     db.delete(problem)
     db.commit()
     return True
@@ -759,34 +1286,39 @@ def delete_problem(*, db: Database, id: ID) -> bool:
 
 
 @router.put("/report/{problem}/{team}", tags=["report"], name="upload")
-def add_report(
+async def add_report(
     *,
-    db: Database,
-    login: LoggedIn,
+    db: AsyncDatabase,
+    login: AsyncPrincipal,
     team: ID,
     problem: ID,
     file: UploadFile,
 ) -> Report:
-    if file.size and ServerSettings.get(db).upload_file_limit < file.size:
+    if file.size and (await db.run_sync(ServerSettings.cached)).upload_file_limit < file.size:
         raise ValueError
-    problem_model = Problem.get_unwrap(db, problem)
-    team_model = Team.get_unwrap(db, team)
-    if problem_model.tournament != team_model.tournament:
+    problem_model = await db.run_sync(Problem.get_unwrap, problem)
+    team_model = await db.run_sync(Team.get_unwrap, team)
+    if problem_model.tournament_id != team_model.tournament_id:
         raise HTTPException(400, "Selected team and problem are not in the same tournament")
-    problem_model.assert_editable(login.team)
-    report = db.scalar(select(Report).where(Report.team_id == team, Report.problem_id == problem))
+    problem_model.assert_editable(login.logged_in if login else None)
+    report = await db.scalar(
+        select(Report)
+        .where(Report.team_id == team, Report.problem_id == problem)
+        .options(selectinload(Report.team), selectinload(Report.problem), selectinload(Report.file))
+    )
     if report:
         report.file = DbFile.from_file(file)
     else:
         report = Report(team_model, problem_model, DbFile.from_file(file))
         db.add(report)
-    db.commit()
+    await run_in_threadpool(report.file.save)
+    await commit_async(db)
     return report
 
 
 @router.delete("/report/{problem}/{team}", tags=["report"], name="delete")
 def delete_report(db: Database, login: LoggedIn, team: ID, problem: ID) -> None:
-    if isinstance(login.team, Team) and team != login.team.id:
+    if isinstance(login.team, TeamRef) and team != login.team.id:
         raise HTTPException(403)
     report = db.scalar(select(Report).where(Report.team_id == team, Report.problem_id == problem))
     if report is None:
@@ -798,22 +1330,56 @@ def delete_report(db: Database, login: LoggedIn, team: ID, problem: ID) -> None:
 class Reports(BaseSchema):
     reports: dict[UUID, schemas.Report]
     teams: dict[ID, schemas.Team]
-    total: int
+    total: int | None
+    next_cursor: str | None = None
+
+
+report_order = Keyset((Report.team_id, False), (Report.problem_id, False))
 
 
 @router.get("/report", tags=["report"], name="get")
-def get_reports(
-    db: Database, login: LoggedIn, problem: UUID | None = None, team: UUID | None = None, offset: int = 0
+async def get_reports(
+    db: AsyncDatabase,
+    login: AsyncPrincipal,
+    problem: UUID | None = None,
+    team: UUID | None = None,
+    offset: int = 0,
+    cursor: str | None = None,
+    count: bool = True,
 ) -> Reports:
-    filters = [Report.visible_sql(login.team)]
+    filters = [Report.visible_sql(login.logged_in if login else None)]
     if problem:
         filters.append(Report.problem_id == problem)
     if team:
         filters.append(Report.team_id == team)
 
-    reports = db.scalars(select(Report).where(*filters).limit(SQL_LIMIT).offset(offset)).unique().all()
-    count = db.scalar(select(func.count()).select_from(Report).where(*filters)) or 0
-    return Reports(reports=encode(reports), teams=encode(report.team for report in reports), total=count)
+    reports, next_cursor = report_order.page(
+        (
+            await db.scalars(
+                report_order.paginate(
+                    select(Report)
+                    .where(*filters)
+                    .options(
+                        team_schema(selectinload(Report.team)),
+                        selectinload(Report.problem),
+                        selectinload(Report.file),
+                        only_selected(Report),
+                    ),
+                    cursor,
+                    offset,
+                )
+            )
+        )
+        .unique()
+        .all()
+    )
+    total = await db.scalar(select(func.count()).select_from(Report).where(*filters)) or 0 if count else None
+    return Reports(
+        reports=encode(reports),
+        teams=encode(report.team for report in reports),
+        total=total,
+        next_cursor=next_cursor,
+    )
 
 
 # *******************************************************************************
@@ -821,26 +1387,49 @@ def get_reports(
 # *******************************************************************************
 
 
-class ProgramResults(BaseSchema):
-    programs: dict[ID, schemas.Program]
+class ProgramResultsBase(BaseSchema):
+    """Fields shared by the full and normalized program search results."""
+
     teams: dict[ID, schemas.Team]
     problems: dict[ID, schemas.Problem]
-    total: int
+    total: int | None
+    next_cursor: str | None = None
 
 
-@router.get("/program", tags=["program"], name="get")
-def search_program(
+class ProgramResults(ProgramResultsBase):
+    programs: dict[ID, schemas.Program]
+
+
+class NormalizedProgramResults(ProgramResultsBase):
+    programs: dict[ID, schemas.NormalizedProgram]
+    files: dict[ID, schemas.DbFile]
+
+
+program_order = Keyset((Program.creation_time, True), (Program.id, True))
+
+
+@router.get("/program", tags=["program"], name="get", response_model=ProgramResults)
+async def search_program(
     *,
-    db: Database,
-    login: LoggedIn,
+    db: AsyncDatabase,
+    login: AsyncPrincipal,
     name: str | None = None,
     team: ID | None = None,
     role: Role | None = None,
     problem: ID | None = None,
     tournament: ID | None = None,
     offset: int = 0,
-) -> ProgramResults:
-    filters = [Program.visible_sql(login.team)]
+    cursor: str | None = None,
+    count: bool = True,
+    normalize: bool = False,
+    fields: str | None = None,
+) -> ProgramResults | Response:
+    """Searches the visible programs, newest first.
+
+    With `normalize` the programs reference their files by id and the files are listed in an additional `files`
+    map. The response can be restricted to a sparse fieldset like `programs(name,file),files(location)`.
+    """
+    filters = [Program.visible_sql(login.logged_in if login else None)]
     if name is not None:
         filters.append(Program.name.contains(name, autoescape=True))
     if team is not None:
@@ -851,42 +1440,64 @@ def search_program(
         filters.append(Program.problem_id == problem)
     if tournament is not None:
         filters.append(Program.problem.has(Problem.tournament_id == tournament))
-    programs = (
-        db.scalars(
-            select(Program).where(*filters).order_by(Program.creation_time.desc()).limit(SQL_LIMIT).offset(offset)
+    query = (
+        select(Program)
+        .where(*filters)
+        .options(
+            team_schema(selectinload(Program.team)),
+            selectinload(Program.problem).selectinload(Problem.tournament),
+            selectinload(Program.file),
+            only_selected(Program),
         )
-        .unique()
-        .all()
     )
-    total_count = db.scalar(select(func.count()).select_from(Program).where(*filters)) or 0
-    return ProgramResults(
-        programs=encode(programs),
-        teams=encode(program.team for program in programs),
-        problems=encode(program.problem for program in programs),
-        total=total_count,
+    programs, next_cursor = program_order.page(
+        (await db.scalars(program_order.paginate(query, cursor, offset))).unique().all()
     )
+    total_count = await db.scalar(select(func.count()).select_from(Program).where(*filters)) or 0 if count else None
+    teams = encode(program.team for program in programs)
+    problems = encode(program.problem for program in programs)
+    if normalize:
+        return respond(
+            NormalizedProgramResults(
+                programs={program.id: schemas.NormalizedProgram.model_validate(program) for program in programs},
+                files=encode(program.file for program in programs),
+                teams=teams,
+                problems=problems,
+                total=total_count,
+                next_cursor=next_cursor,
+            ),
+            fields,
+        )
+    data = ProgramResults(
+        programs=encode(programs), teams=teams, problems=problems, total=total_count, next_cursor=next_cursor
+    )
+    return respond(data, fields) if fields else data
 
 
 @router.post("/program", tags=["program"], name="create")
-def upload_program(
+async def upload_program(
     *,
-    db: Database,
-    login: LoggedIn,
+    db: AsyncDatabase,
+    login: AsyncPrincipal,
     name: str = "",
     role: Role,
     problem: ID,
     file: UploadFile,
 ) -> Program:
-    if file.size and ServerSettings.get(db).upload_file_limit < file.size:
+    if file.size and (await db.run_sync(ServerSettings.cached)).upload_file_limit < file.size:
         raise ValueError
-    problem_obj = unwrap(db.get(Problem, problem))
-    problem_obj.assert_visible(login.team)
-    if not isinstance(login.team, Team):
+    login_team = login.logged_in if login else None
+    problem_obj = await db.run_sync(Problem.get_unwrap, problem)
+    problem_obj.assert_visible(login_team)
+    if not isinstance(login_team, TeamRef):
         raise HTTPException(400, "User has not selected a team")
-    problem_obj.assert_editable(login.team)
-    prog = Program(name, login.team, role, DbFile.from_file(file), problem_obj)
+    problem_obj.assert_editable(login_team)
+    team = await db.run_sync(Team.get_unwrap, login_team.id)
+    prog = Program(name, team, role, DbFile.from_file(file), problem_obj)
     db.add(prog)
-    db.commit()
+    # storing the file before committing keeps the blocking io out of the session's commit hooks
+    await run_in_threadpool(prog.file.save)
+    await commit_async(db)
     return prog
 
 
@@ -912,9 +1523,11 @@ class ScheduleInfo(BaseSchema):
 def scheduled_matches(*, db: Database, login: LoggedIn) -> ScheduleInfo:
     matches = (
         db.scalars(
-            select(ScheduledMatch).where(
-                ScheduledMatch.problem.has((Problem.tournament == login.tournament) & Problem.visible_sql(login.team))
+            select(ScheduledMatch)
+            .where(
+                ScheduledMatch.problem.has((Problem.tournament_id == login.tournament_id) & Problem.visible_sql(login.team))
             )
+            .options(selectinload(ScheduledMatch.problem).selectinload(Problem.tournament), only_selected(ScheduledMatch))
         )
         .unique()
         .all()
@@ -931,7 +1544,7 @@ def create_schedule(
     problem: ID,
     points: int = 100,
 ) -> ScheduledMatch:
-    problem_ = unwrap(db.get(Problem, problem))
+    problem_ = Problem.get_unwrap(db, problem)
     schedule = ScheduledMatch(time=time, problem=problem_, name=name, points=points)
     db.add(schedule)
     db.commit()
@@ -952,7 +1565,7 @@ def edit_schedule(
     if name is not None:
         match.name = name
     if problem is not None:
-        match.problem = unwrap(db.get(Problem, problem))
+        match.problem = Problem.get_unwrap(db, problem)
     if points is not None:
         match.points = points
     if time is not None:
@@ -969,27 +1582,221 @@ def delete_schedule(*, db: Database, id: ID) -> bool:
     return True
 
 
-class MatchResultData(BaseSchema):
+class MatchResultDataBase(BaseSchema):
+    """Fields shared by the full and normalized match result responses."""
+
     problems: dict[ID, schemas.Problem]
-    results: dict[ID, schemas.MatchResult]
     teams: dict[ID, schemas.Team]
+    next_cursor: str | None = None
 
 
-@router.get("/match/result", tags=["match"], name="getResult")
+class MatchResultData(MatchResultDataBase):
+    results: dict[ID, schemas.MatchResult]
+
+
+class NormalizedMatchResultData(MatchResultDataBase):
+    results: dict[ID, schemas.NormalizedMatchResult]
+    programs: dict[ID, schemas.NormalizedProgram]
+    files: dict[ID, schemas.DbFile]
+
+
+result_order = Keyset((MatchResult.time, True), (MatchResult.id, True))
+
+
+class JSONStreamingResponse(StreamingResponse):
+    media_type = "application/json"
+
+
+@router.get(
+    "/match/result",
+    tags=["match"],
+    name="getResult",
+    response_class=JSONStreamingResponse,
+    responses={200: {"model": MatchResultData}},
+)
 def results(
-    *, db: Database, login: LoggedIn, problem: ID | None = None, tournament: ID | None = None
-) -> MatchResultData:
+    *,
+    login: LoggedIn,
+    problem: ID | None = None,
+    tournament: ID | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    latest: bool = False,
+    cursor: str | None = None,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    normalize: bool = False,
+    fields: str | None = None,
+) -> Response:
+    """Streams the visible match results, newest first.
+
+    All matching results are sent unless a `limit` is given, in which case the `next_cursor` can be used to fetch the
+    following page. With `latest` only the most recent result of each problem is included.
+
+    With `normalize` the participants reference their programs by id, which are listed in an additional `programs`
+    map, and programs and results reference their files by id in a `files` map. The response can be restricted to a
+    sparse fieldset like `results(time,participants.points),teams(name)`.
+    """
+    include = sparse_fields(NormalizedMatchResultData if normalize else MatchResultData, fields) if fields else None
     filters = [MatchResult.problem.has(Problem.visible_sql(login.team))]
     if problem is not None:
         filters.append(MatchResult.problem_id == problem)
     if tournament is not None:
-        filters.append(MatchResult.problem.has(Problem.tournament_id == tournament))
-    results = db.scalars(select(MatchResult).where(*filters)).all()
-    return MatchResultData(
-        results=encode(results),
-        problems=encode(result.problem for result in results),
-        teams=encode(participant.team for result in results for participant in result.participants),
-    )
+        filters.append(MatchResult.problem_id.in_(select(Problem.id).where(Problem.tournament_id == tournament)))
+    if since is not None:
+        filters.append(MatchResult.time >= since)
+    if until is not None:
+        filters.append(MatchResult.time < until)
+    if latest:
+        ranked = (
+            select(
+                MatchResult.id,
+                func.row_number()
+                .over(partition_by=MatchResult.problem_id, order_by=result_order.order_by())
+                .label("rank"),
+            )
+            .where(*filters)
+            .subquery()
+        )
+        filters = [MatchResult.id.in_(select(ranked.c.id).where(ranked.c.rank == 1))]
+    query = select(MatchResult.id, MatchResult.time).where(*filters)
+    return JSONStreamingResponse(iterate_results(query, cursor, limit, normalize=normalize, include=include))
+
+
+def _section(include: dict[str, Any] | None, name: str) -> tuple[bool, Any]:
+    """Whether the response section is selected and the include specification of its entries."""
+    if include is None or include.get(name) is True:
+        return True, None
+    if name not in include:
+        return False, None
+    return True, include[name].get("__all__")
+
+
+def iterate_results(
+    query: Select[tuple[ID, datetime]],
+    cursor: str | None,
+    limit: int | None,
+    *,
+    normalize: bool = False,
+    include: dict[str, Any] | None = None,
+    batch_size: int = 200,
+) -> Iterator[bytes]:
+    """Streams the selected match results as a `MatchResultData` or `NormalizedMatchResultData` object.
+
+    The results are fetched one keyset page at a time, and each page's related rows are loaded on the same session
+    before it is sent. The connection is returned to the pool while a page is being sent, so slow clients don't hold
+    on to it and the memory used is independent of the number of results.
+    """
+    if normalize:
+        schema = schemas.NormalizedMatchResult
+        loads = [selectinload(MatchResult.participants).raiseload("*", sql_only=True)]
+    else:
+        schema = schemas.MatchResult
+        # the programs only reference their team and problem, so those are loaded without any of their relationships
+        loads = [
+            selectinload(MatchResult.participants).options(
+                *(
+                    selectinload(program)
+                    .options(
+                        selectinload(Program.team).raiseload("*"),
+                        selectinload(Program.problem).raiseload("*"),
+                        selectinload(Program.file),
+                    )
+                    .raiseload("*", sql_only=True)
+                    for program in (ResultParticipant.generator, ResultParticipant.solver)
+                )
+            )
+            .raiseload("*", sql_only=True),
+            selectinload(MatchResult.logs),
+        ]
+    send_results, result_fields = _section(include, "results")
+    problems, teams, programs, files = set[ID](), set[ID](), set[ID](), set[ID]()
+    count, taken, more = 0, 0, False
+    with SessionLocal() as db:
+        yield b'{"results":{' if send_results else b"{"
+        while True:
+            size = batch_size if limit is None else min(batch_size, limit - taken)
+            rows = db.execute(result_order.paginate(query, cursor, limit=size)).all()
+            batch, more = rows[:size], len(rows) > size
+            loaded = db.scalars(
+                select(MatchResult)
+                .where(MatchResult.id.in_(row.id for row in batch))
+                .options(selectinload(MatchResult.problem).raiseload("*"), *loads, only_selected(MatchResult))
+            )
+            results = {result.id: result for result in loaded}
+            chunk = list[str]()
+            for row in batch:
+                if (result := results.get(row.id)) is None:
+                    continue
+                if send_results:
+                    entry = schema.model_validate(result).model_dump_json(include=result_fields)
+                    chunk.append(f'{"," if count else ""}"{row.id}":{entry}')
+                count += 1
+                problems.add(result.problem_id)
+                for participant in result.participants:
+                    teams.add(participant.team_id)
+                    programs.update(id for id in (participant.generator_id, participant.solver_id) if id)
+                if result.logs_id is not None:
+                    files.add(result.logs_id)
+            # ends the transaction so that the connection isn't held while the client receives the page
+            db.close()
+            if chunk:
+                yield "".join(chunk).encode()
+            taken += len(batch)
+            if not more:
+                break
+            cursor = result_order.cursor(batch[-1])
+            if limit is not None and taken >= limit:
+                break
+        if send_results:
+            yield b"},"
+
+        sections: list[tuple[str, TypeAdapter[Any], Callable[[], Any]]] = [
+            (
+                "problems",
+                _problem_map,
+                lambda: encode(
+                    db.scalars(select(Problem).where(Problem.id.in_(problems)).options(selectinload(Problem.tournament)))
+                    .unique()
+                ),
+            ),
+            (
+                "teams",
+                _team_map,
+                lambda: encode(db.scalars(team_schema(select(Team).where(Team.id.in_(teams)))).unique()),
+            ),
+        ]
+        if normalize:
+            programs_models = (
+                db.scalars(
+                    select(Program)
+                    .where(Program.id.in_(programs))
+                    .options(selectinload(Program.team), selectinload(Program.problem), only_selected(Program))
+                )
+                .unique()
+                .all()
+            )
+            files.update(program.file_id for program in programs_models)
+            sections += [
+                (
+                    "programs",
+                    _program_map,
+                    lambda: {program.id: schemas.NormalizedProgram.model_validate(program) for program in programs_models},
+                ),
+                ("files", _file_map, lambda: encode(db.scalars(select(DbFile).where(DbFile.id.in_(files))))),
+            ]
+        for name, adapter, contents in sections:
+            selected, entry_fields = _section(include, name)
+            if selected:
+                data = adapter.dump_json(contents(), include={"__all__": entry_fields} if entry_fields else None)
+                db.close()
+                yield f'"{name}":'.encode() + data + b","
+        yield f'"next_cursor":{json.dumps(cursor if more else None)}}}'.encode()
+
+
+_problem_map = TypeAdapter(dict[ID, schemas.Problem])
+_team_map = TypeAdapter(dict[ID, schemas.Team])
+_program_map = TypeAdapter(dict[ID, schemas.NormalizedProgram])
+_file_map = TypeAdapter(dict[ID, schemas.DbFile])
 
 
 @admin.delete("/match/result/{id}", tags=["match"], name="deleteResults")
@@ -999,10 +1806,32 @@ def delete_results(*, db: Database, id: ID) -> None:
     db.commit()
 
 
+def _participants(
+    loader: BatchLoader,
+    teams: list[UUID],
+    generators: list[UUID | None | Literal["undefined"]],
+    solvers: list[UUID | None | Literal["undefined"]],
+    points: list[float],
+) -> set[ResultParticipant]:
+    """Builds the participants of a result, loading all referenced teams and programs with one query each."""
+    loader.want(Team, teams)
+    loader.want(Program, (id for id in chain(generators, solvers) if isinstance(id, UUID)))
+    return {
+        ResultParticipant(
+            team=loader.get_unwrap(Team, team),
+            generator=loader.get_unwrap(Program, gen) if isinstance(gen, UUID) else None,
+            solver=loader.get_unwrap(Program, sol) if isinstance(sol, UUID) else None,
+            points=p,
+        )
+        for team, gen, sol, p in zip(teams, generators, solvers, points, strict=True)
+    }
+
+
 @admin.post("/match/result", tags=["match"], name="createResult", response_model=schemas.MatchResult)
 def add_result(
     *,
     db: Database,
+    loader: Loader,
     status: MatchStatus,
     time: datetime,
     problem: UUID,
@@ -1012,22 +1841,14 @@ def add_result(
     points: InForm[list[float]],
     logs: UploadFile | None = None,
 ) -> MatchResult:
-    if logs is not None and logs.size and ServerSettings.get(db).upload_file_limit < logs.size:
+    if logs is not None and logs.size and ServerSettings.cached(db).upload_file_limit < logs.size:
         raise ValueError
-    problem_model = unwrap(db.get(Problem, problem))
+    problem_model = Problem.get_unwrap(db, problem)
     file = DbFile.from_file(logs) if logs else None
     if len(teams) != len(set(teams)):
         raise HTTPException(422, "Each team can can only appear once in each match")
     try:
-        participants = {
-            ResultParticipant(
-                team=Team.get_unwrap(db, team),
-                generator=Program.get_unwrap(db, gen) if isinstance(gen, UUID) else None,
-                solver=Program.get_unwrap(db, sol) if isinstance(sol, UUID) else None,
-                points=p,
-            )
-            for team, gen, sol, p in zip(teams, generators, solvers, points, strict=True)
-        }
+        participants = _participants(loader, teams, generators, solvers, points)
     except ValueError:
         raise HTTPException(422, "Length of participant field infos was not equal")
     db_res = MatchResult(status=status, time=time, problem=problem_model, participants=participants, logs=file)
@@ -1039,6 +1860,7 @@ def add_result(
 @admin.put("/match/result/{id}", tags=["match"], name="editResult", response_model=schemas.MatchResult)
 def update_result(
     db: Database,
+    loader: Loader,
     id: UUID,
     time: InForm[datetime],
     problem: InForm[UUID],
@@ -1057,20 +1879,12 @@ def update_result(
         res.logs = None
     elif isinstance(logs, UUID):
         res.logs = DbFile.get_unwrap(db, logs)
-    elif logs.size and ServerSettings.get(db).upload_file_limit < logs.size:
+    elif logs.size and ServerSettings.cached(db).upload_file_limit < logs.size:
         raise ValueError
     else:
         res.logs = DbFile.from_file(logs)
     try:
-        res.participants = {
-            ResultParticipant(
-                team=Team.get_unwrap(db, team),
-                generator=Program.get_unwrap(db, gen) if isinstance(gen, UUID) else None,
-                solver=Program.get_unwrap(db, sol) if isinstance(sol, UUID) else None,
-                points=p,
-            )
-            for team, gen, sol, p in zip(teams, generators, solvers, points, strict=True)
-        }
+        res.participants = _participants(loader, teams, generators, solvers, points)
     except ValueError:
         raise HTTPException(422, "Length of participant field infos was not equal")
     db.commit()
@@ -1088,10 +1902,15 @@ def get_extra_points(
 ) -> Sequence[ExtraPoints]:
     filters = [ExtraPoints.visible_sql(login.team)]
     if tournament is not None:
-        filters.append(ExtraPoints.team.has(Team.tournament_id == tournament))
+        filters.append(ExtraPoints.team_id.in_(select(Team.id).where(Team.tournament_id == tournament)))
     if tag is not None:
         filters.append(ExtraPoints.tag == tag)
-    return sorted(db.scalars(select(ExtraPoints).where(*filters)).all(), key=lambda p: p.time)
+    query = (
+        select(ExtraPoints)
+        .where(*filters)
+        .options(team_schema(selectinload(ExtraPoints.team)), only_selected(ExtraPoints))
+    )
+    return sorted(db.scalars(query).all(), key=lambda p: p.time)
 
 
 @admin.post("/extrapoints", tags=["extrapoints"], name="create")
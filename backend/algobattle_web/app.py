@@ -1,6 +1,6 @@
 from contextlib import asynccontextmanager
 import json
-from importlib.resources import as_file, files
+from typing import Any
 
 from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError, HTTPException
@@ -8,54 +8,26 @@ from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from sqlalchemy_utils.functions import database_exists, create_database
-from sqlalchemy import create_engine
-from alembic.config import Config
-from alembic.command import upgrade, stamp
-from alembic.migration import MigrationContext
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from algobattle_web.models import Base, ServerSettings, User
+from algobattle_web.database import create_async_db_engine, create_db_engine, query_metrics, track_queries
 from algobattle_web.api import router as api, SchemaRoute
-from algobattle_web.util import EnvConfig, PermissionExcpetion, ValueTaken, SessionLocal
+from algobattle_web.migrate import check_revision
+from algobattle_web.util import AsyncSessionLocal, EnvConfig, PermissionExcpetion, ValueTaken, SessionLocal
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    engine = create_engine(EnvConfig.get().db_url)
+    engine = create_db_engine()
     SessionLocal.configure(bind=engine)
+    async_engine = create_async_db_engine()
+    AsyncSessionLocal.configure(bind=async_engine)
 
-    # this creates the database itself, alembic/sqlalchemy code below creates the tables in it
-    if not database_exists(engine.url):
-        create_database(engine.url)
-
-    # because python packaged may be installed to eg zipfiles we need make sure all the data is actually on disk
-    # however, that isn't easy here since alembic (presumably) expects a bunch of files in a certain structure.
-    # this code's invocation of alembic will (probably) just break if you use esoteric install options 🤷‍♀️
-    data_files = files("algobattle_web.alembic")
-    with as_file(data_files / "alembic.ini") as alembic_ini:
-        alembic_cfg = Config(alembic_ini)
-        alembic_cfg.set_main_option("script_location", str(alembic_ini.parent))
-        with engine.connect() as connection:
-            context = MigrationContext.configure(connection)
-            current_revs = context.get_current_heads()
-            if not current_revs:
-                Base.metadata.create_all(bind=engine)
-                stamp(alembic_cfg, "head")
-            else:
-                upgrade(alembic_cfg, "head")
-
-    with SessionLocal() as db:
-        try:
-            ServerSettings.get(db)
-        except RuntimeError:
-            db.add(ServerSettings())
-        root = User.get(db, "")
-        if root is None:
-            root = User(email="", name="Root", is_admin=True)
-            db.add(root)
-            db.commit()
-        print(f"Root user login link:\n{EnvConfig.get().base_url}?login_token={root.login_token(db)}")
+    check_revision(engine)
     yield
+    await async_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -116,6 +88,45 @@ for route in app.routes:
         route.operation_id = route.name
 
 
+class QueryTimingMiddleware:
+    """Counts the database queries of each request.
+
+    The totals are sent to the client in a `Server-Timing` header and aggregated per route in `query_metrics`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.routes: dict[Any, str] = {}
+
+    def route(self, scope: Scope) -> str | None:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return None
+        if not self.routes:
+            self.routes = {route.endpoint: route.path for route in scope["app"].routes if isinstance(route, APIRoute)}
+        path = self.routes.get(endpoint)
+        return f"{scope['method']} {path}" if path else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        with track_queries() as stats:
+            try:
+                await self.app(scope, receive, send_timing)
+            finally:
+                route = self.route(scope)
+                if route is not None:
+                    query_metrics.record(route, stats)
+
+
+app.add_middleware(QueryTimingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[EnvConfig.get().base_url],
@@ -3,13 +3,15 @@ from os import environ
 from time import sleep
 from zipfile import ZipFile
 from anyio import run
-from sqlalchemy import select, create_engine
+from sqlalchemy import select
 
 from algobattle.match import Match, AlgobattleConfig, TeamInfo, ProjectConfig
 from algobattle.util import Role, TempDir, ExceptionInfo
 from algobattle.battle import ProgramLogConfigTime
+from algobattle_web.database import create_db_engine
+from algobattle_web.migrate import check_revision
 from algobattle_web.models import MatchResult, Program, ResultParticipant, ScheduledMatch, File, Session
-from algobattle_web.util import EnvConfig, MatchStatus, install_packages, SessionLocal
+from algobattle_web.util import MatchStatus, install_packages, SessionLocal
 
 
 def run_match(db: Session, scheduled_match: ScheduledMatch):
@@ -99,8 +101,9 @@ def run_match(db: Session, scheduled_match: ScheduledMatch):
 
 
 def main():
-    engine = create_engine(EnvConfig.get().db_url)
+    engine = create_db_engine()
     SessionLocal.configure(bind=engine)
+    check_revision(engine)
     last_check = datetime.now()
     while True:
         with SessionLocal() as db:
@@ -0,0 +1,136 @@
+"""Microbenchmarks of performance sensitive code paths.
+
+Run them with
+
+    python -m algobattle_web.benchmarks serialization
+    python -m algobattle_web.benchmarks imports
+
+Each benchmark prints the best time of several repetitions for the code path it measures and the one it replaces.
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from datetime import datetime
+from functools import partial
+import json
+from subprocess import run as run_process
+import sys
+from timeit import repeat
+from types import SimpleNamespace
+from typing import Any, Callable
+from uuid import UUID, uuid4
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from algobattle.util import Role
+from algobattle_web import schemas
+
+
+def _report(name: str, runs: int, timings: dict[str, Callable[[], Any]]) -> None:
+    print(name)
+    baseline = None
+    for label, func in timings.items():
+        best = min(repeat(func, number=1, repeat=runs))
+        baseline = baseline or best
+        print(f"  {label:<10} {best * 1000:9.2f} ms  {baseline / best:5.2f}x")
+
+
+def _programs(count: int) -> dict[UUID, schemas.Program]:
+    """An `encode()`ed map of programs, as returned by the program search endpoint."""
+    team, problem = SimpleNamespace(id=uuid4()), SimpleNamespace(id=uuid4())
+    now = datetime.now()
+    programs = (
+        SimpleNamespace(
+            id=uuid4(),
+            name=f"program {i}",
+            team=team,
+            role=Role.generator if i % 2 else Role.solver,
+            file=SimpleNamespace(
+                id=uuid4(),
+                filename=f"program {i}.zip",
+                media_type="application/zip",
+                timestamp=now,
+                alt_text="",
+                variants=[],
+            ),
+            creation_time=now,
+            problem=problem,
+            user_editable=True,
+        )
+        for i in range(count)
+    )
+    return {program.id: schemas.Program.model_validate(program) for program in programs}
+
+
+def serialization(count: int, runs: int) -> None:
+    """Compares FastAPI's response serialization with the one done by `SchemaRoute`."""
+    from algobattle_web.api import SchemaRoute
+
+    content = _programs(count)
+
+    def endpoint() -> dict[UUID, schemas.Program]:
+        return content
+
+    route = SchemaRoute("/", endpoint)
+
+    async def fastapi() -> bytes:
+        serialized = await serialize_response(
+            field=route.secure_cloned_response_field, response_content=content, is_coroutine=True
+        )
+        return JSONResponse(serialized).body
+
+    def schema_route() -> bytes:
+        return route.render(content).body
+
+    _report(
+        f"serializing {count} programs",
+        runs,
+        {"fastapi": lambda: run(fastapi()), "SchemaRoute": schema_route},
+    )
+
+
+def imports(module: str, runs: int) -> None:
+    """Compares importing a module with and without the match engine in a fresh interpreter."""
+
+    def probe(imports: str) -> list[str]:
+        return [
+            sys.executable,
+            "-c",
+            f"import {imports}, sys, json, resource; "
+            "print(json.dumps([resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "
+            "sorted(m for m in sys.modules if m.split('.')[0] in ('algobattle', 'docker'))]))",
+        ]
+
+    variants = {"eager": probe(f"{module}, algobattle.match"), "lazy": probe(module)}
+    _report(
+        f"importing {module}",
+        runs,
+        {label: partial(run_process, command, check=True, capture_output=True) for label, command in variants.items()},
+    )
+    for label, command in variants.items():
+        # peak resident memory is reported in KiB on linux
+        memory, modules = json.loads(run_process(command, check=True, capture_output=True, text=True).stdout)
+        print(f"  {label:<10} {memory / 1024:9.1f} MiB  {len(modules)} modules of the match engine loaded")
+
+
+def main() -> None:
+    """Runs the selected benchmark."""
+    parser = ArgumentParser(description="Microbenchmarks of performance sensitive code paths.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    serialization_parser = subparsers.add_parser("serialization", help=serialization.__doc__)
+    serialization_parser.add_argument("--count", type=int, default=5000, help="Number of encoded programs.")
+    serialization_parser.add_argument("--runs", type=int, default=10)
+    imports_parser = subparsers.add_parser("imports", help=imports.__doc__)
+    imports_parser.add_argument("--module", default="algobattle_web.app", help="Module whose import is measured.")
+    imports_parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    match args.benchmark:
+        case "serialization":
+            serialization(args.count, args.runs)
+        case "imports":
+            imports(args.module, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Caching of the responses of read heavy endpoints."""
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+from typing import Any, Awaitable, Callable, ClassVar, TypeVar
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.event import listens_for
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from algobattle_web.models import Principal, Problem
+from algobattle_web.util import AsyncSessionLocal, SessionLocal
+
+F = TypeVar("F", bound=Callable[..., Any])
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+def cached(*depends: type) -> Callable[[F], F]:
+    """Caches the endpoint's responses until a commit changes one of the given models.
+
+    Routes read the dependencies from the endpoint, so this needs to be applied before the endpoint is registered.
+    """
+
+    def decorator(endpoint: F) -> F:
+        endpoint.cache_depends = frozenset(depends)  # type: ignore
+        return endpoint
+
+    return decorator
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """A serialized response and when it needs to be recomputed."""
+
+    body: bytes
+    media_type: str | None
+    etag: str
+    expires: float
+
+
+def _scope(principal: Principal | None) -> str:
+    """The part of the login that determines what data is visible."""
+    match principal.logged_in if principal else None:
+        case "admin":
+            return f"admin:{principal.tournament_id if principal else None}"
+        case None:
+            return "anonymous"
+        case team:
+            return f"team:{team.id}"
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+class ResponseCache:
+    """In memory cache of serialized responses.
+
+    Entries are keyed by the route, its arguments, and the visibility scope of the requester. They are dropped when a
+    commit changes one of the models the route depends on or a problem becomes visible by reaching its start time.
+    Other processes like the match runner can't notify the cache, so entries also expire after `ttl` seconds. Empty
+    (`null`) responses aren't stored since they usually mean that the worker hasn't computed the data yet. Responses
+    carry an ETag so that clients revalidating an unchanged response get an empty 304.
+    """
+
+    ttl: ClassVar[float] = 10
+    max_entries: ClassVar[int] = 10_000
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, str, str], CachedResponse] = {}
+        self._depends: dict[str, frozenset[type]] = {}
+        self._lock = Lock()
+        # incremented by every invalidation so that responses computed concurrently with a change aren't stored
+        self._generation = 0
+
+    def invalidate(self, changed: set[type] | None = None) -> None:
+        """Drops the entries of all routes that depend on one of the changed models, or all entries."""
+        with self._lock:
+            self._generation += 1
+            if changed is None:
+                self._entries.clear()
+                return
+            routes = {route for route, depends in self._depends.items() if not depends.isdisjoint(changed)}
+            if routes:
+                self._entries = {key: entry for key, entry in self._entries.items() if key[0] not in routes}
+
+    def _get(self, key: tuple[str, str, str]) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= monotonic():
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return entry
+
+    def _set(self, key: tuple[str, str, str], entry: CachedResponse, generation: int) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = entry
+
+    @staticmethod
+    def _respond(entry: CachedResponse, request: Request) -> Response:
+        headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache", "Vary": "X-User-Token"}
+        if _matches(request.headers.get("If-None-Match"), entry.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type=entry.media_type, headers=headers)
+
+    async def _expires(self, db: AsyncSession, depends: frozenset[type]) -> float:
+        """When a new entry of a route with these dependencies needs to be recomputed."""
+        expires = monotonic() + self.ttl
+        if Problem in depends:
+            now = datetime.now()
+            next_start = await db.scalar(select(func.min(Problem.start)).where(Problem.start > now))
+            if next_start is not None:
+                expires = min(expires, monotonic() + (next_start - now).total_seconds())
+        return expires
+
+    def wrap(self, route: str, depends: frozenset[type], handler: Handler) -> Handler:
+        """Wraps the request handler of a route so that it serves cached responses."""
+        self._depends[route] = depends
+
+        async def cached_handler(request: Request) -> Response:
+            # closed before the handler runs, so that a request never holds more than one connection at a time
+            async with AsyncSessionLocal() as db:
+                principal = await db.run_sync(Principal.from_token, request.headers.get("X-User-Token"))
+                key = (route, f"{request.url.path}?{sorted(request.query_params.multi_items())}", _scope(principal))
+                entry = self._get(key)
+                if entry is not None:
+                    return self._respond(entry, request)
+
+                generation = self._generation
+                expires = await self._expires(db, depends)
+            response = await handler(request)
+            if response.status_code != 200 or not hasattr(response, "body") or response.background is not None:
+                return response
+            body = bytes(response.body)
+            if body == b"null":
+                return response
+            etag = f'"{blake2b(body, digest_size=16).hexdigest()}"'
+            entry = CachedResponse(body, response.media_type, etag, expires)
+            self._set(key, entry, generation)
+            return self._respond(entry, request)
+
+        return cached_handler
+
+
+response_cache = ResponseCache()
+
+
+@listens_for(SessionLocal, "after_flush")
+def record_changes(db: Session, _flush_context: Any) -> None:
+    changed = db.info.setdefault("changed_models", set())
+    changed.update(type(obj) for obj in (*db.new, *db.dirty, *db.deleted))
+
+
+@listens_for(SessionLocal, "after_commit")
+def invalidate_responses(db: Session) -> None:
+    changed = db.info.pop("changed_models", None)
+    if changed:
+        response_cache.invalidate(changed)
+
+
+@listens_for(SessionLocal, "after_rollback")
+def discard_changes(db: Session) -> None:
+    db.info.pop("changed_models", None)
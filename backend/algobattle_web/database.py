@@ -0,0 +1,301 @@
+"""Creation of the database engines and monitoring of their connection pools and the queries they run."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+from typing import Any, Iterator
+
+from sqlalchemy import Connection, Engine, create_engine, event
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, Pool, QueuePool
+
+from algobattle_web.util import BaseSchema, EnvConfig
+
+
+@dataclass
+class PoolMetrics:
+    """Counters describing how connections have been checked out of a pool."""
+
+    checkouts: int = 0
+    waited: int = 0
+    total_wait: float = 0
+    max_wait: float = 0
+    overflows: int = 0
+    timeouts: int = 0
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    # checkouts that took less than this are served from the pool and not counted as waiting
+    wait_threshold = 0.001
+
+    def record(self, wait: float, *, overflow: bool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            if wait >= self.wait_threshold:
+                self.waited += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if overflow:
+                self.overflows += 1
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+
+class _MeteredPool(QueuePool):
+    """Queue pool that records how long callers wait for connections."""
+
+    metrics: PoolMetrics
+
+    def __init__(self, *args: Any, metrics: PoolMetrics | None = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics if metrics is not None else PoolMetrics()
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        overflow = self.overflow()
+        start = perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeout:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record(perf_counter() - start, overflow=self.overflow() > max(overflow, 0))
+        return conn
+
+    def recreate(self) -> "_MeteredPool":
+        # mirrors QueuePool.recreate, the replacement pool keeps counting into the same metrics
+        self.logger.info("Pool recreating")
+        return type(self)(
+            self._creator,
+            pool_size=self._pool.maxsize,
+            max_overflow=self._max_overflow,
+            pre_ping=self._pre_ping,
+            use_lifo=self._pool.use_lifo,
+            timeout=self._timeout,
+            recycle=self._recycle,
+            echo=self.echo,
+            logging_name=self._orig_logging_name,
+            reset_on_return=self._reset_on_return,
+            _dispatch=self.dispatch,
+            dialect=self._dialect,
+            metrics=self.metrics,
+        )
+
+
+class MeteredQueuePool(_MeteredPool):
+    """Queue pool used by the sync engine."""
+
+
+class MeteredAsyncQueuePool(_MeteredPool, AsyncAdaptedQueuePool):
+    """Queue pool used by the async engine."""
+
+
+def _pool_options(config: EnvConfig) -> dict[str, Any]:
+    return {
+        "pool_size": config.pool_size,
+        "max_overflow": config.pool_overflow,
+        "pool_timeout": config.pool_timeout,
+        "pool_recycle": config.pool_recycle,
+        "pool_pre_ping": config.pool_pre_ping,
+    }
+
+
+def create_db_engine() -> Engine:
+    """Creates the sync engine with the pool configured in the environment."""
+    config = EnvConfig.get()
+    engine = create_engine(config.db_url, poolclass=MeteredQueuePool, **_pool_options(config))
+    instrument(engine)
+    return engine
+
+
+def create_async_db_engine() -> AsyncEngine:
+    """Creates the async engine with the pool configured in the environment."""
+    config = EnvConfig.get()
+    engine = create_async_engine(config.async_db_url, poolclass=MeteredAsyncQueuePool, **_pool_options(config))
+    instrument(engine.sync_engine)
+    return engine
+
+
+@dataclass
+class QueryStats:
+    """Statements executed while handling a single request or inside a `track_queries` block."""
+
+    count: int = 0
+    time: float = 0
+    statements: list[str] | None = None
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.time += duration
+        if self.statements is not None:
+            self.statements.append(statement)
+
+    def server_timing(self) -> str:
+        """Formats the stats as the value of a `Server-Timing` header."""
+        return f'db;dur={self.time * 1000:.1f};desc="{self.count} queries"'
+
+
+_current_queries: ContextVar[QueryStats | None] = ContextVar("current_queries", default=None)
+# collectors that see every statement regardless of the context it was executed in, used when asserting query counts
+_global_queries: list[QueryStats] = []
+
+
+def _before_execute(conn: Connection, cursor: Any, statement: str, *args: Any) -> None:
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+def _after_execute(conn: Connection, cursor: Any, statement: str, *args: Any) -> None:
+    duration = perf_counter() - conn.info["query_start"].pop()
+    stats = _current_queries.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    for stats in _global_queries:
+        stats.record(statement, duration)
+
+
+def _failed_execute(context: ExceptionContext) -> None:
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def instrument(engine: Engine) -> None:
+    """Records the statements executed by the engine in the stats of the currently handled request."""
+    if not event.contains(engine, "before_cursor_execute", _before_execute):
+        event.listen(engine, "before_cursor_execute", _before_execute)
+        event.listen(engine, "after_cursor_execute", _after_execute)
+        event.listen(engine, "handle_error", _failed_execute)
+
+
+@contextmanager
+def track_queries(*, statements: bool = False) -> Iterator[QueryStats]:
+    """Records the statements executed in the current context, e.g. while handling a request."""
+    stats = QueryStats(statements=[] if statements else None)
+    token = _current_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_queries.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int) -> Iterator[QueryStats]:
+    """Fails if more than `limit` statements are executed on any instrumented engine inside the block.
+
+    Statements are counted regardless of the thread or task running them, so requests made with a test client are
+    included. Use it to catch code that loads related objects one query at a time::
+
+        with assert_max_queries(5):
+            client.get("/api/match/result")
+    """
+    stats = QueryStats(statements=[])
+    _global_queries.append(stats)
+    try:
+        yield stats
+    finally:
+        _global_queries.remove(stats)
+    if stats.count > limit:
+        listing = "\n".join(f"  {statement}" for statement in stats.statements or ())
+        raise AssertionError(f"{stats.count} queries were executed, expected at most {limit}:\n{listing}")
+
+
+@dataclass
+class RouteQueries:
+    """Aggregated query stats of all requests handled by a route."""
+
+    requests: int = 0
+    queries: int = 0
+    max_queries: int = 0
+    time: float = 0
+    max_time: float = 0
+
+    def record(self, stats: QueryStats) -> None:
+        self.requests += 1
+        self.queries += stats.count
+        self.max_queries = max(self.max_queries, stats.count)
+        self.time += stats.time
+        self.max_time = max(self.max_time, stats.time)
+
+
+class QueryMetrics:
+    """Per route aggregates of the query stats since the server started."""
+
+    def __init__(self) -> None:
+        self._routes: dict[str, RouteQueries] = {}
+        self._lock = Lock()
+
+    def record(self, route: str, stats: QueryStats) -> None:
+        with self._lock:
+            self._routes.setdefault(route, RouteQueries()).record(stats)
+
+    def snapshot(self) -> dict[str, RouteQueries]:
+        with self._lock:
+            return {route: RouteQueries(**vars(queries)) for route, queries in self._routes.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+
+query_metrics = QueryMetrics()
+
+
+class PoolStats(BaseSchema):
+    """Current state of a connection pool and its metrics since the server started."""
+
+    size: int
+    max_overflow: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    checkouts: int
+    waited: int
+    total_wait: float
+    max_wait: float
+    overflows: int
+    timeouts: int
+
+    @classmethod
+    def of(cls, pool: Pool) -> "PoolStats | None":
+        if not isinstance(pool, _MeteredPool):
+            return None
+        metrics = pool.metrics
+        return cls(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            checkouts=metrics.checkouts,
+            waited=metrics.waited,
+            total_wait=metrics.total_wait,
+            max_wait=metrics.max_wait,
+            overflows=metrics.overflows,
+            timeouts=metrics.timeouts,
+        )
+
+
+class RouteQueryStats(BaseSchema):
+    """Query stats of a route since the server started."""
+
+    requests: int
+    queries: int
+    max_queries: int
+    average_queries: float
+    time: float
+    max_time: float
+    average_time: float
+
+    @classmethod
+    def of(cls, queries: RouteQueries) -> "RouteQueryStats":
+        return cls(
+            requests=queries.requests,
+            queries=queries.queries,
+            max_queries=queries.max_queries,
+            average_queries=queries.queries / queries.requests if queries.requests else 0,
+            time=queries.time,
+            max_time=queries.max_time,
+            average_time=queries.time / queries.requests if queries.requests else 0,
+        )
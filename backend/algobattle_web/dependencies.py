@@ -1,11 +1,13 @@
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Annotated, AsyncIterable, Literal, Self
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from algobattle_web.models import Team, Tournament, User, Session
-from algobattle_web.util import SessionLocal
+from algobattle_web.models import ID, BatchLoader, Principal, Team, TeamRef, Tournament, User, Session
+from algobattle_web.util import AsyncSessionLocal, SessionLocal
 
 
 async def get_db() -> AsyncIterable[Session]:
@@ -20,10 +22,46 @@ async def get_db() -> AsyncIterable[Session]:
 Database = Annotated[Session, Depends(get_db)]
 
 
-def curr_user(
-    db: Session = Depends(get_db), user_token: str | None = Depends(APIKeyHeader(name="X-User-Token"))
-) -> User | None:
-    return User.decode_token(db, user_token)
+async def get_async_db() -> AsyncIterable[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
+
+
+AsyncDatabase = Annotated[AsyncSession, Depends(get_async_db)]
+
+
+async def get_loader(db: Database) -> BatchLoader:
+    return BatchLoader(db)
+
+
+Loader = Annotated[BatchLoader, Depends(get_loader)]
+
+
+# the principal is resolved on the session the endpoint uses, so that each request only checks out one connection
+def curr_principal(
+    db: Database, user_token: str | None = Depends(APIKeyHeader(name="X-User-Token"))
+) -> Principal | None:
+    return Principal.from_token(db, user_token)
+
+
+CurrPrincipal = Annotated[Principal | None, Depends(curr_principal)]
+
+
+async def curr_principal_async(
+    db: AsyncDatabase, user_token: str | None = Depends(APIKeyHeader(name="X-User-Token"))
+) -> Principal | None:
+    return await db.run_sync(Principal.from_token, user_token)
+
+
+AsyncPrincipal = Annotated[Principal | None, Depends(curr_principal_async)]
+
+
+def curr_user(db: Session = Depends(get_db), principal: Principal | None = Depends(curr_principal)) -> User | None:
+    return db.get(User, principal.user_id) if principal is not None else None
 
 
 CurrUser = Annotated[User | None, Depends(curr_user)]
@@ -31,27 +69,45 @@ CurrUser = Annotated[User | None, Depends(curr_user)]
 
 @dataclass
 class LoginInfo:
-    user: User | None
+    """Information about the logged in user.
+
+    Only the data needed for permission checks is loaded up front, the full database objects are loaded on access.
+    """
+
+    principal: Principal | None
+    db: Session
 
     @property
-    def team(self) -> Team | Literal["admin"] | None:
-        return self.user.logged_in if self.user else None
+    def team(self) -> TeamRef | Literal["admin"] | None:
+        return self.principal.logged_in if self.principal else None
 
     @property
+    def tournament_id(self) -> ID | None:
+        return self.principal.tournament_id if self.principal else None
+
+    @cached_property
+    def user(self) -> User | None:
+        return self.db.get(User, self.principal.user_id) if self.principal else None
+
+    @cached_property
+    def team_model(self) -> Team | None:
+        if self.principal is None or self.principal.team is None:
+            return None
+        return Team.get(self.db, self.principal.team.id)
+
+    @cached_property
     def tournament(self) -> Tournament | None:
-        return self.user.tournament if self.user else None
+        tournament_id = self.tournament_id
+        return Tournament.get(self.db, tournament_id) if tournament_id is not None else None
 
     @classmethod
-    def dependency(cls, user: CurrUser) -> Self:
-        if user is not None:
-            return cls(user)
-        else:
-            return cls(None)
+    async def dependency(cls, db: Database, principal: CurrPrincipal) -> Self:
+        return cls(principal, db)
 
 
 LoggedIn = Annotated[LoginInfo, Depends(LoginInfo.dependency)]
 
 
-def check_if_admin(user: User = Depends(curr_user)):
-    if not user.is_admin:
+async def check_if_admin(principal: CurrPrincipal):
+    if principal is None or not principal.is_admin:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,243 @@
+"""Durable background jobs and the worker that runs them.
+
+Jobs are stored in the database, usually in the same transaction as the change that requires them, so they survive
+restarts of the web server. They are run by a separate worker process started with `algobattle_worker`.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from hashlib import sha256
+import json
+from os import environ
+from smtplib import SMTPException
+from time import sleep
+from traceback import format_exc
+from typing import Any, Callable, Iterable
+from uuid import UUID
+
+from sqlalchemy import delete, func, select, update
+
+from algobattle_web.database import create_db_engine
+from algobattle_web.mail import mail_sender
+from algobattle_web.migrate import check_revision
+from algobattle_web.models import ID, File, Job, Problem, ServerSettings, Session, User
+from algobattle_web.util import EnvConfig, JobKind, JobStatus, SessionLocal
+
+
+# how many jobs of each kind may run at the same time across all workers
+CONCURRENCY: dict[JobKind, int] = {
+    # installing the dependencies of several problems at once would have pip processes interfere with each other
+    JobKind.page_data: 1,
+    JobKind.image_variants: 2,
+    JobKind.compress_files: 1,
+    # emails are sent over a single rate limited connection
+    JobKind.login_email: 1,
+}
+# number of login emails sent by a single job
+LOGIN_EMAIL_BATCH = 50
+# running jobs that haven't finished after this long are assumed to belong to a crashed worker and are retried
+STALE_AFTER = timedelta(hours=1)
+# finished jobs are kept this long so their status can still be checked
+KEEP_FINISHED = timedelta(days=7)
+
+
+class PartialFailure(Exception):
+    """Raised by job handlers that failed after doing part of their work, the retry only gets the remaining `args`."""
+
+    def __init__(self, **args: Any) -> None:
+        super().__init__(args)
+        self.remaining = args
+
+
+def _encode(kind: JobKind, args: dict[str, Any]) -> tuple[dict[str, Any], str]:
+    """The JSON representation of the arguments and the job's deduplication key."""
+    encoded = json.dumps(args, sort_keys=True, default=str)
+    return json.loads(encoded), f"{kind.value}:{sha256(encoded.encode()).hexdigest()}"
+
+
+def enqueue(db: Session, kind: JobKind, *, max_attempts: int = 3, **args: Any) -> Job:
+    """Adds a job to the session, or returns the equivalent one that is still waiting to be run.
+
+    The job is only stored when the session is committed.
+    """
+    encoded, key = _encode(kind, args)
+    pending = db.scalars(select(Job).where(Job.key == key, Job.status == JobStatus.pending)).first()
+    if pending is not None:
+        return pending
+    job = Job(kind=kind, args=encoded, key=key, max_attempts=max_attempts)
+    db.add(job)
+    return job
+
+
+def enqueue_catch_up(db: Session) -> None:
+    """Adds jobs computing the data that older versions of the server didn't precompute yet."""
+    images = db.execute(
+        select(File.id, File.variants)
+        .join(Problem, Problem.image_id == File.id)
+        .where(File.media_type.startswith("image/"), File.media_type != "image/svg+xml")
+    ).all()
+    for id, variants in images:
+        if not variants:
+            enqueue(db, JobKind.image_variants, file=id)
+    for id, page_data in db.execute(select(Problem.id, Problem.page_data)).all():
+        if page_data is None:
+            enqueue(db, JobKind.page_data, problem=id)
+
+
+def compute_page_data(problem: str) -> None:
+    """Renders the problem page of a newly uploaded problem file."""
+    Problem.compute_page_data(UUID(problem))
+
+
+def compute_image_variants(file: str) -> None:
+    """Creates the resized versions of an uploaded image."""
+    File.compute_variants(UUID(file))
+
+
+def compress_files() -> None:
+    """Compresses all stored files that aren't yet."""
+    File.compress_all()
+
+
+def send_login_emails(users: list[str], target_url: str) -> None:
+    """Sends users links that log them in."""
+    with SessionLocal() as db:
+        config = ServerSettings.cached(db).email_config
+        messages: list[tuple[str, EmailMessage]] = []
+        for user in db.scalars(select(User).where(User.id.in_([UUID(id) for id in users]))):
+            token = user.login_token(db)
+            url = str(EnvConfig.get().base_url) + target_url + f"?login_token={token}"
+            if environ.get("DEV") and not config.server:
+                print(f"sending email to {user.email}: {url}")
+                continue
+            msg = EmailMessage()
+            msg["Subject"] = "Algobattle login"
+            msg["From"] = config.address
+            msg["To"] = user.email
+            msg.set_content(url)
+            messages.append((str(user.id), msg))
+    for i, (_, msg) in enumerate(messages):
+        try:
+            refused = mail_sender.send(config, [msg])
+        except (SMTPException, OSError) as e:
+            # users that already got their email shouldn't get it again when the job is retried
+            raise PartialFailure(users=[id for id, _ in messages[i:]], target_url=target_url) from e
+        if refused:
+            print(f"the mail server refused the login email to {msg['To']}")
+
+
+def enqueue_login_emails(db: Session, users: Iterable[ID], target_url: str) -> list[Job]:
+    """Adds jobs that send login links to the users, in batches that are each sent over one connection."""
+    ids = sorted(users)
+    return [
+        enqueue(db, JobKind.login_email, users=ids[i : i + LOGIN_EMAIL_BATCH], target_url=target_url)
+        for i in range(0, len(ids), LOGIN_EMAIL_BATCH)
+    ]
+
+
+HANDLERS: dict[JobKind, Callable[..., None]] = {
+    JobKind.page_data: compute_page_data,
+    JobKind.image_variants: compute_image_variants,
+    JobKind.compress_files: compress_files,
+    JobKind.login_email: send_login_emails,
+}
+
+
+def claim() -> Job | None:
+    """Marks the next runnable job as running and returns it."""
+    with SessionLocal() as db:
+        running = dict(
+            db.execute(
+                select(Job.kind, func.count()).where(Job.status == JobStatus.running).group_by(Job.kind)
+            ).tuples().all()
+        )
+        full = [kind for kind, limit in CONCURRENCY.items() if running.get(kind, 0) >= limit]
+        now = datetime.now()
+        job = db.scalars(
+            select(Job)
+            .where(Job.status == JobStatus.pending, Job.run_after <= now, Job.kind.not_in(full))
+            .order_by(Job.run_after)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if job is None:
+            return None
+        job.status = JobStatus.running
+        job.attempts += 1
+        job.started = now
+        # detached before committing so that the loaded values aren't expired
+        db.flush()
+        db.expunge(job)
+        db.commit()
+        return job
+
+
+def execute(job: Job) -> None:
+    """Runs the job and records its outcome, failed jobs are retried with an exponential backoff."""
+    try:
+        HANDLERS[job.kind](**job.args)
+    except Exception as e:
+        error = format_exc()
+        print(f"job {job.id} ({job.kind.value}) failed:\n{error}")
+        values: dict[str, Any] = {"error": error}
+        if job.attempts < job.max_attempts:
+            values |= {"status": JobStatus.pending, "run_after": datetime.now() + timedelta(seconds=30 * 2**job.attempts)}
+            if isinstance(e, PartialFailure):
+                values["args"], values["key"] = _encode(job.kind, e.remaining)
+        else:
+            values |= {"status": JobStatus.failed, "finished": datetime.now()}
+    else:
+        values = {"status": JobStatus.complete, "finished": datetime.now(), "error": None}
+    with SessionLocal() as db:
+        db.execute(update(Job).where(Job.id == job.id).values(**values))
+        db.commit()
+
+
+def clean_up() -> None:
+    """Retries jobs of crashed workers and removes old finished jobs."""
+    now = datetime.now()
+    with SessionLocal() as db:
+        db.execute(
+            update(Job)
+            .where(Job.status == JobStatus.running, Job.started < now - STALE_AFTER)
+            .values(status=JobStatus.pending, run_after=now)
+        )
+        db.execute(
+            delete(Job).where(Job.status.in_((JobStatus.complete, JobStatus.failed)), Job.finished < now - KEEP_FINISHED)
+        )
+        db.commit()
+
+
+def work(*, concurrency: int = 4, poll_interval: float = 1, clean_up_interval: float = 600) -> None:
+    """Runs jobs until interrupted."""
+    running: set[Future[None]] = set()
+    next_clean_up = datetime.now()
+    with ThreadPoolExecutor(concurrency) as pool:
+        while True:
+            if datetime.now() >= next_clean_up:
+                clean_up()
+                next_clean_up = datetime.now() + timedelta(seconds=clean_up_interval)
+            while len(running) < concurrency and (job := claim()) is not None:
+                running.add(pool.submit(execute, job))
+            if running:
+                _, running = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                sleep(poll_interval)
+
+
+def main() -> None:
+    """Entry point of the background worker."""
+    parser = ArgumentParser(description="Runs the background jobs of the web server.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of jobs run at the same time.")
+    parser.add_argument("--poll-interval", type=float, default=1, help="Seconds between checks for new jobs.")
+    args = parser.parse_args()
+
+    engine = create_db_engine()
+    SessionLocal.configure(bind=engine)
+    check_revision(engine)
+    work(concurrency=args.concurrency, poll_interval=args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
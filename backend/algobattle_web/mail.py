@@ -0,0 +1,91 @@
+"""Delivery of emails to the configured mail server."""
+from email.message import EmailMessage
+from smtplib import SMTP, SMTPException, SMTPNotSupportedError, SMTPRecipientsRefused, SMTPServerDisconnected
+from threading import Lock
+from time import monotonic, sleep
+from typing import ClassVar, Iterable
+
+from algobattle_web.util import EmailConfig
+
+
+class MailSender:
+    """Sends emails over a single SMTP connection that is reused between batches.
+
+    Connecting, STARTTLS and authenticating only happen again once the mail server closed the connection, it has been
+    idle for `idle_timeout` seconds, or the email settings changed. Delivery is limited to `rate` messages per second
+    so that large batches don't run into the mail server's limits.
+    """
+
+    rate: ClassVar[float] = 5
+    idle_timeout: ClassVar[float] = 60
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._server: SMTP | None = None
+        self._config: EmailConfig | None = None
+        self._last_used = 0.0
+        self._next_send = 0.0
+
+    def _connection(self, config: EmailConfig) -> SMTP:
+        if self._server is not None and (config != self._config or monotonic() - self._last_used > self.idle_timeout):
+            self._close()
+        if self._server is None:
+            server = SMTP(config.server, config.port, timeout=30)
+            server.ehlo()
+            # only local stand-ins for a mail server are allowed to opt out of encryption, never fall back to
+            # plaintext just because the server didn't advertise STARTTLS
+            if config.tls:
+                if not server.has_extn("starttls"):
+                    server.close()
+                    raise SMTPNotSupportedError("The mail server doesn't support STARTTLS.")
+                server.starttls()
+                server.ehlo()
+            if config.username:
+                server.login(config.username, config.password)
+            self._server, self._config = server, config
+        return self._server
+
+    def _close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (SMTPException, OSError):
+                pass
+            self._server = None
+
+    def _throttle(self) -> None:
+        now = monotonic()
+        if self._next_send > now:
+            sleep(self._next_send - now)
+        self._next_send = max(now, self._next_send) + 1 / self.rate
+
+    def _deliver(self, config: EmailConfig, message: EmailMessage) -> None:
+        try:
+            self._connection(config).send_message(message, from_addr=config.username or config.address)
+        except SMTPServerDisconnected:
+            self._server = None
+            self._connection(config).send_message(message, from_addr=config.username or config.address)
+        self._last_used = monotonic()
+
+    def send(self, config: EmailConfig, messages: Iterable[EmailMessage]) -> list[EmailMessage]:
+        """Sends the messages and returns the ones whose recipients were refused.
+
+        Errors that affect the connection itself are raised.
+        """
+        refused = []
+        with self._lock:
+            for message in messages:
+                self._throttle()
+                try:
+                    self._deliver(config, message)
+                except SMTPRecipientsRefused:
+                    refused.append(message)
+        return refused
+
+    def close(self) -> None:
+        """Closes the connection to the mail server."""
+        with self._lock:
+            self._close()
+
+
+mail_sender = MailSender()
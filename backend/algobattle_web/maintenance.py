@@ -0,0 +1,83 @@
+"""Maintenance tasks that are run outside of the web server."""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterator
+from uuid import UUID
+
+from sqlalchemy import select
+
+from algobattle_web.database import create_db_engine
+from algobattle_web.models import File
+from algobattle_web.storage import Storage, StoredFile, get_storage
+from algobattle_web.util import SessionLocal
+
+
+def _batched(entries: Iterator[StoredFile], size: int) -> Iterator[list[StoredFile]]:
+    while batch := list(islice(entries, size)):
+        yield batch
+
+
+def _file_id(key: str) -> UUID | None:
+    try:
+        return UUID(key[:36])
+    except ValueError:
+        return None
+
+
+def collect_garbage(
+    storage: Storage, *, grace_period: timedelta = timedelta(hours=1), batch_size: int = 1000, dry_run: bool = False
+) -> None:
+    """Removes all data from the storage that does not belong to any file in the database.
+
+    Data younger than the grace period is kept since its file may be in the process of being created. Files that
+    were stored before their size was recorded are measured on the way.
+    """
+    cutoff = datetime.now(timezone.utc) - grace_period
+    removed = removed_size = foreign = 0
+    for batch in _batched(storage.entries(), batch_size):
+        ids = {id for entry in batch if (id := _file_id(entry.key)) is not None}
+        with SessionLocal() as db:
+            files = {file.id: file for file in db.scalars(select(File).where(File.id.in_(ids)))}
+            for entry in batch:
+                id = _file_id(entry.key)
+                if id is None:
+                    foreign += 1
+                    continue
+                file = files.get(id)
+                if file is not None and entry.key in file.stored_keys():
+                    if file.size is None and entry.key == file.key:
+                        file.size = entry.size if file.encoding is None else file.measure()
+                    continue
+                if entry.modified > cutoff:
+                    continue
+                removed += 1
+                removed_size += entry.size
+                if not dry_run:
+                    storage.remove(entry.key)
+            if not dry_run:
+                db.commit()
+    verb = "would remove" if dry_run else "removed"
+    print(f"{verb} {removed} orphaned files totalling {removed_size} bytes, ignored {foreign} unknown files")
+
+
+def main() -> None:
+    """Entry point of the storage garbage collector."""
+    parser = ArgumentParser(description="Removes stored data that does not belong to any file in the database.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed.")
+    parser.add_argument("--grace-period", type=float, default=1, help="Hours new data is kept for.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_db_engine()
+    SessionLocal.configure(bind=engine)
+    collect_garbage(
+        get_storage(),
+        grace_period=timedelta(hours=args.grace_period),
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
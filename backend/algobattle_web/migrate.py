@@ -0,0 +1,104 @@
+"""Setup and migration of the database.
+
+This runs as a one-shot command before the other services are started, so that they only need to check the database's
+revision instead of every process racing to migrate it.
+"""
+from contextlib import contextmanager
+from importlib.resources import as_file, files
+from typing import Iterator
+
+from alembic.command import stamp, upgrade
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy_utils.functions import create_database, database_exists
+
+from algobattle_web.database import create_db_engine
+from algobattle_web.models import Base, ServerSettings, User
+from algobattle_web.util import EnvConfig, SessionLocal
+
+
+@contextmanager
+def alembic_config() -> Iterator[Config]:
+    """The alembic config of the migrations shipped with this package."""
+    # because python packaged may be installed to eg zipfiles we need make sure all the data is actually on disk
+    # however, that isn't easy here since alembic (presumably) expects a bunch of files in a certain structure.
+    # this code's invocation of alembic will (probably) just break if you use esoteric install options 🤷‍♀️
+    data_files = files("algobattle_web.alembic")
+    with as_file(data_files / "alembic.ini") as alembic_ini:
+        config = Config(alembic_ini)
+        config.set_main_option("script_location", str(alembic_ini.parent))
+        yield config
+
+
+def check_revision(engine: Engine) -> None:
+    """Makes sure the database has been migrated to the revision this version of the code expects.
+
+    This only reads the alembic version table, so it is cheap enough to run on every process start.
+    """
+    with alembic_config() as config:
+        expected = set(ScriptDirectory.from_config(config).get_heads())
+    with engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if current != expected:
+        raise RuntimeError(
+            f"The database is at revision {', '.join(current) or 'none'} but {', '.join(expected)} is expected, "
+            "run `algobattle_migrate` to update it."
+        )
+
+
+@contextmanager
+def _migration_lock(connection: Connection, timeout: int = 600) -> Iterator[None]:
+    """Prevents several migrations from running at the same time."""
+    if connection.dialect.name != "mysql":
+        yield
+        return
+    if connection.scalar(text("SELECT GET_LOCK('algobattle_migrate', :timeout)"), {"timeout": timeout}) != 1:
+        raise RuntimeError("Timed out waiting for another migration to finish.")
+    try:
+        yield
+    finally:
+        connection.execute(text("SELECT RELEASE_LOCK('algobattle_migrate')"))
+
+
+def migrate(engine: Engine) -> None:
+    """Creates or updates the database's tables and makes sure the server settings and root user exist."""
+    # this creates the database itself, alembic/sqlalchemy code below creates the tables in it
+    if not database_exists(engine.url):
+        create_database(engine.url)
+
+    with alembic_config() as config, engine.connect() as connection, _migration_lock(connection):
+        context = MigrationContext.configure(connection)
+        if not context.get_current_heads():
+            Base.metadata.create_all(bind=engine)
+            stamp(config, "head")
+        else:
+            upgrade(config, "head")
+
+    with SessionLocal() as db:
+        try:
+            ServerSettings.get(db)
+        except RuntimeError:
+            db.add(ServerSettings())
+        root = User.get(db, "")
+        if root is None:
+            root = User(email="", name="Root", is_admin=True)
+            db.add(root)
+        # imported here since the worker itself checks the database revision with this module
+        from algobattle_web.jobs import enqueue_catch_up
+
+        enqueue_catch_up(db)
+        db.commit()
+        print(f"Root user login link:\n{EnvConfig.get().base_url}?login_token={root.login_token(db)}")
+
+
+def main() -> None:
+    """Entry point of the database migration."""
+    engine = create_db_engine()
+    SessionLocal.configure(bind=engine)
+    migrate(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,57 @@
 "Database models"
 from abc import abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import timedelta, datetime
+from hashlib import sha256
 from secrets import token_bytes
-from typing import IO, Callable, ClassVar, Iterable, Any, TypeAlias, BinaryIO, Literal, Self, cast, overload, Annotated, Sequence
+from threading import Lock
+from time import monotonic
+from typing import IO, Callable, ClassVar, Iterable, Any, TypeAlias, BinaryIO, Literal, Self, TypeVar, cast, overload, Annotated, Sequence
 from typing_extensions import TypedDict
 from uuid import UUID, uuid4
+from io import SEEK_END, TextIOWrapper
 from pathlib import Path
-from shutil import copyfileobj, copyfile, move
+from shutil import copyfileobj
 from zipfile import ZipFile
 
 from jose import jwt
 from jose.exceptions import ExpiredSignatureError, JWTError
-from sqlalchemy import JSON, ColumnElement, LargeBinary, MetaData, Table, ForeignKey, Column, select, DateTime, inspect, String, Text
+from sqlalchemy import JSON, BigInteger, ColumnElement, LargeBinary, MetaData, Table, ForeignKey, Column, select, DateTime, inspect, String, Text
 from sqlalchemy.event import listens_for
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import true as sql_true, false as sql_false
 from sqlalchemy.orm import relationship, Mapped, mapped_column, Session, DeclarativeBase, registry, MappedAsDataclass
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.schema import Index, UniqueConstraint
 from sqlalchemy.sql.base import _NoArg
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pydantic import ByteSize, Field
+from PIL import Image as PILImage, UnidentifiedImageError
 
 from algobattle.util import TempDir, Role as ProgramRole
-from algobattle.match import AlgobattleConfig
 from algobattle_web import schemas
+from algobattle_web.storage import get_storage
 from algobattle_web.util import (
     BaseSchema,
+    BinaryUUID,
     EmailConfig,
+    JobKind,
+    JobStatus,
     MatchStatus,
     PermissionExcpetion,
     SqlableModel,
+    StorageEncoding,
+    encode_stream,
+    encoding_suffix,
     guess_mimetype,
     SessionLocal,
     install_packages,
     render_text,
+    storage_encoding,
     unwrap,
 )
 
@@ -43,46 +62,55 @@ str64 = Annotated[str, mapped_column(String(64)), Field(max_length=64)]
 str128 = Annotated[str, mapped_column(String(128)), Field(max_length=128)]
 str256 = Annotated[str, mapped_column(String(256)), Field(max_length=256)]
 strText = Annotated[str, mapped_column(Text)]
-LoggedIn: TypeAlias = "Team | Literal['admin'] | None"
+TeamLike: TypeAlias = "Team | TeamRef"
+LoggedIn: TypeAlias = "Team | TeamRef | Literal['admin'] | None"
+
+
+@dataclass(frozen=True)
+class TeamRef:
+    """Reference to a team containing just the data needed for permission checks."""
+
+    id: ID
+    tournament_id: ID
 
 
 # cant make it an ABC because of metaclass issues
 class PermissionCheck:
 
     @abstractmethod
-    def _visible(self, team: "Team") -> bool:
+    def _visible(self, team: TeamLike) -> bool:
         raise NotImplementedError
 
     @classmethod
     @abstractmethod
-    def _visible_sql(cls, team: "Team") -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         raise NotImplementedError
 
-    def _editable(self, team: "Team") -> bool:
+    def _editable(self, team: TeamLike) -> bool:
         return self._visible(team)
 
     @classmethod
-    def _editable_sql(cls, team: "Team") -> ColumnElement[bool]:
+    def _editable_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return cls._visible_sql(team)
 
     def visible(self, team: LoggedIn) -> bool:
         match team:
             case "admin":
                 return True
-            case Team():
-                return self._visible(team)
             case None:
                 return False
+            case _:
+                return self._visible(team)
 
     @classmethod
     def visible_sql(cls, team: LoggedIn) -> ColumnElement[bool]:
         match team:
             case "admin":
                 return sql_true()
-            case Team():
-                return cls._visible_sql(team)
             case None:
                 return sql_false()
+            case _:
+                return cls._visible_sql(team)
 
     def assert_visible(self, team: LoggedIn) -> None:
         if not self.visible(team):
@@ -92,20 +120,20 @@ class PermissionCheck:
         match team:
             case "admin":
                 return True
-            case Team():
-                return self._visible(team) and self._editable(team)
             case None:
                 return False
+            case _:
+                return self._visible(team) and self._editable(team)
 
     @classmethod
     def editable_sql(cls, team: LoggedIn) -> ColumnElement[bool]:
         match team:
             case "admin":
                 return sql_true()
-            case Team():
-                return cls._visible_sql(team) & cls._editable_sql(team)
             case None:
                 return sql_false()
+            case _:
+                return cls._visible_sql(team) & cls._editable_sql(team)
 
     def assert_editable(self, team: LoggedIn) -> None:
         if not self.editable(team):
@@ -126,6 +154,7 @@ class RawBase(MappedAsDataclass, DeclarativeBase):
         type_annotation_map={
             datetime: DateTime,
             ProblemPageData: JSON,
+            UUID: BinaryUUID,
         }
     )
 
@@ -182,7 +211,116 @@ class Base(RawBase):
     @classmethod
     def get_unwrap(cls, db: Session, id: ID) -> Self:
         """Get the specified entry and raise an error if it does not exist."""
-        return unwrap(db.get(cls, id))
+        return unwrap(entity_cache.get(db, cls, id))
+
+
+T_Base = TypeVar("T_Base", bound=Base)
+
+
+class EntityCache:
+    """Process wide cache of the column values of rarely changing database objects, keyed by their id.
+
+    Objects of the cached types are rebuilt from the cached values and attached to the session without querying the
+    database, their relationships are loaded lazily as usual. Commits that change cached objects evict them, each type
+    also has a version that is incremented by such commits so that values loaded concurrently aren't stored. Other
+    processes can't evict entries, so they also expire after `ttl` seconds.
+    """
+
+    ttl: ClassVar[float] = 30
+    max_entries: ClassVar[int] = 10_000
+
+    def __init__(self, *types: type[Base]) -> None:
+        self.types = frozenset(types)
+        self._entries: dict[tuple[type[Base], ID], tuple[float, dict[str, Any]]] = {}
+        self._versions: dict[type[Base], int] = {cls: 0 for cls in types}
+        self._lock = Lock()
+
+    def get(self, db: Session, cls: type[T_Base], id: ID) -> T_Base | None:
+        """Gets the specified entry from the session, the cache, or the database, in that order."""
+        if cls not in self.types:
+            return db.get(cls, id)
+        key = identity_key(cls, id)
+        if key in db.identity_map:
+            return cast(T_Base, db.identity_map[key])
+        entry = self._entries.get((cls, id))
+        if entry is not None and entry[0] > monotonic():
+            obj = cls.__mapper__.class_manager.new_instance()
+            for attr, value in entry[1].items():
+                set_committed_value(obj, attr, value)
+            make_transient_to_detached(obj)
+            db.add(obj)
+            return obj
+
+        version = self._versions[cls]
+        obj = db.get(cls, id)
+        if obj is not None:
+            state = inspect(obj)
+            values = {attr.key: state.dict[attr.key] for attr in cls.__mapper__.column_attrs if attr.key in state.dict}
+            with self._lock:
+                if version == self._versions[cls]:
+                    if len(self._entries) >= self.max_entries:
+                        self._entries.clear()
+                    self._entries[(cls, id)] = (monotonic() + self.ttl, values)
+        return obj
+
+    def evict(self, objects: Iterable[tuple[type[Base], ID]]) -> None:
+        """Removes the objects from the cache."""
+        with self._lock:
+            for cls, id in objects:
+                self._versions[cls] += 1
+                self._entries.pop((cls, id), None)
+
+
+class BatchLoader:
+    """Loads database objects by their ids, fetching all requested ids of a type with a single query.
+
+    Ids that will be needed are first registered with `want`, the first lookup of an object of that type then loads
+    every pending id at once. Objects are only ever loaded once per loader, so it should live as long as the session.
+    """
+
+    def __init__(self, db: Session) -> None:
+        self.db = db
+        self._pending: dict[type[Base], set[ID]] = defaultdict(set)
+        self._loaded: dict[type[Base], dict[ID, Any]] = defaultdict(dict)
+
+    def want(self, cls: type[Base], ids: Iterable[ID]) -> None:
+        """Registers ids that will be looked up later."""
+        loaded = self._loaded[cls]
+        self._pending[cls].update(id for id in ids if id not in loaded)
+
+    def _load(self, cls: type[Base]) -> None:
+        ids = self._pending.pop(cls, None)
+        if not ids:
+            return
+        loaded = self._loaded[cls]
+        for obj in self.db.scalars(select(cls).where(cls.id.in_(ids))).unique():
+            loaded[obj.id] = obj
+        for id in ids:
+            loaded.setdefault(id, None)
+
+    def get(self, cls: type[T_Base], id: ID) -> T_Base | None:
+        """Gets the specified entry, loading it together with all pending ones of its type."""
+        if id not in self._loaded[cls]:
+            self.want(cls, (id,))
+            self._load(cls)
+        return self._loaded[cls][id]
+
+    def get_unwrap(self, cls: type[T_Base], id: ID) -> T_Base:
+        """Gets the specified entry and raise an error if it does not exist."""
+        return unwrap(self.get(cls, id))
+
+    def get_all(self, cls: type[T_Base], ids: Iterable[ID]) -> list[T_Base]:
+        """Gets all specified entries in order and raise an error if any of them do not exist."""
+        ids = list(ids)
+        self.want(cls, ids)
+        return [self.get_unwrap(cls, id) for id in ids]
+
+
+IMAGE_VARIANTS: dict[str, tuple[int, int] | None] = {
+    # problem cards are 18rem wide and the image 10.125rem tall, this is large enough for high dpi screens
+    "thumbnail": (640, 360),
+    "webp": None,
+}
 
 
 class File(Base):
@@ -194,6 +332,9 @@ class File(Base):
     media_type: Mapped[str32]
     alt_text: Mapped[str256]
     timestamp: Mapped[datetime]
+    encoding: Mapped[str32 | None] = mapped_column(default=None)
+    size: Mapped[int | None] = mapped_column(BigInteger, default=None)
+    variants: Mapped[list[str]] = mapped_column(JSON, default_factory=list)
 
     _action: Literal["move", "copy"] = "copy"
     _file: Path | BinaryIO | None = None
@@ -237,12 +378,20 @@ class File(Base):
             file = file.file
         if media_type is None:
             media_type = guess_mimetype(filename)
+        if isinstance(file, Path):
+            size = file.stat().st_size
+        else:
+            position = file.tell()
+            size = file.seek(0, SEEK_END) - position
+            file.seek(position)
         return cls(
             _file=file,
             filename=filename[:128],
             media_type=media_type,
             alt_text=alt_text,
             timestamp=datetime.now(),
+            encoding=storage_encoding(media_type),
+            size=size,
             _action=action,
         )
 
@@ -255,11 +404,33 @@ class File(Base):
             return cls.from_file(file, alt_text=alt_text)
 
     @property
-    def path(self) -> Path:
-        name = str(self.id)
+    def key(self) -> str:
+        """Key identifying the file's contents in the storage backend."""
+        return self._key(cast(StorageEncoding | None, self.encoding))
+
+    def _key(self, encoding: StorageEncoding | None) -> str:
+        key = str(self.id)
         if self.extension is not None:
-            name += f".{self.extension}"
-        return Path("/algobattle/dbfiles") / name
+            key += f".{self.extension}"
+        if encoding is not None:
+            key += f".{encoding_suffix(encoding)}"
+        return key
+
+    def _variant_key(self, variant: str) -> str:
+        return f"{self.id}.{variant}.webp"
+
+    def variant_path(self, variant: str) -> Path:
+        """Path on the local filesystem of a precomputed variant of an image."""
+        return get_storage().path(self._variant_key(variant))
+
+    def stored_keys(self) -> set[str]:
+        """Keys of all data in the storage that belongs to this file."""
+        return {self.key} | {self._variant_key(variant) for variant in self.variants}
+
+    @property
+    def path(self) -> Path:
+        """Path on the local filesystem, its contents are compressed if the file has an `encoding`."""
+        return get_storage().path(self.key)
 
     @property
     def extension(self) -> str | None:
@@ -267,29 +438,129 @@ class File(Base):
         if components:
             return components[-1]
 
+    def exists(self) -> bool:
+        """Checks whether the file's contents are present in the storage."""
+        return get_storage().exists(self.key)
+
     def remove(self) -> None:
-        """Removes the associated file from disk."""
-        if self.path.exists():
-            self.path.unlink()
+        """Removes the associated file from storage."""
+        storage = get_storage()
+        for key in self.stored_keys():
+            storage.remove(key)
 
     def save(self) -> None:
-        """Saves the associated file to disk."""
+        """Saves the associated file to storage."""
         if self._file is not None:
-            self.path.parent.mkdir(parents=True, exist_ok=True)
-            if isinstance(self._file, Path):
-                match self._action:
-                    case "move":
-                        move(self._file, self.path)
-                    case "copy":
-                        copyfile(self._file, self.path)
+            storage = get_storage()
+            if isinstance(self._file, Path) and self.encoding is None:
+                storage.save(self.key, self._file, move=self._action == "move")
+            elif isinstance(self._file, Path):
+                with open(self._file, "rb") as source, self._open_target() as target:
+                    copyfileobj(source, target)
+                if self._action == "move":
+                    self._file.unlink()
             else:
-                with open(self.path, "wb+") as target:
+                with self._open_target() as target:
                     copyfileobj(self._file, target)
             self._file = None
 
-    def open(self, mode: str = "rb") -> IO[Any]:
-        """Opens the underlying file object."""
-        return open(self.path, mode)
+    def _open_target(self) -> BinaryIO:
+        return encode_stream(get_storage().open(self.key, "wb"), cast(StorageEncoding | None, self.encoding), "wb")
+
+    def open(self, mode: Literal["rb", "r"] = "rb") -> IO[Any]:
+        """Opens the underlying file object, decompressing its contents if necessary."""
+        file = encode_stream(get_storage().open(self.key), cast(StorageEncoding | None, self.encoding))
+        if mode == "r":
+            return TextIOWrapper(file)
+        return file
+
+    @staticmethod
+    def _sha256(file: IO[bytes]) -> str:
+        digest = sha256()
+        while chunk := file.read(64 * 1024):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def digest(self) -> str:
+        """Computes the SHA-256 hash of the file's uncompressed contents, which may not have been saved yet."""
+        if isinstance(self._file, Path):
+            with open(self._file, "rb") as file:
+                return self._sha256(file)
+        elif self._file is not None:
+            position = self._file.tell()
+            digest = self._sha256(self._file)
+            self._file.seek(position)
+            return digest
+        else:
+            with self.open() as file:
+                return self._sha256(file)
+
+    def measure(self) -> int:
+        """Computes the size of the file's uncompressed contents."""
+        size = 0
+        with self.open() as file:
+            while chunk := file.read(64 * 1024):
+                size += len(chunk)
+        return size
+
+    def compress(self) -> str | None:
+        """Writes a compressed copy of a file that was stored uncompressed if its media type has a storage encoding.
+
+        Returns the key of the uncompressed copy, which must only be removed once the new encoding has been committed.
+        """
+        encoding = storage_encoding(self.media_type)
+        if self.encoding is not None or encoding is None or not self.exists():
+            return None
+        # the compressed file is written next to the old one and only afterwards becomes the live copy by committing
+        # the new encoding, an interruption at any point leaves at most an unreferenced file behind
+        storage = get_storage()
+        old_key = self.key
+        with storage.open(old_key) as source, encode_stream(storage.open(self._key(encoding), "wb"), encoding, "wb") as target:
+            copyfileobj(source, target)
+        self.encoding = encoding
+        return old_key
+
+    @classmethod
+    def compute_variants(cls, id: ID) -> None:
+        """Precomputes smaller versions of an image so pages showing it don't need to load the full upload."""
+        with SessionLocal() as db:
+            file = db.get(cls, id)
+            if file is None or not file.media_type.startswith("image/") or file.media_type == "image/svg+xml":
+                return
+            try:
+                with file.open() as source:
+                    image = PILImage.open(source)
+                    image.load()
+            except (UnidentifiedImageError, OSError):
+                return
+            storage = get_storage()
+            for variant, max_size in IMAGE_VARIANTS.items():
+                resized = image.copy()
+                if max_size is not None:
+                    resized.thumbnail(max_size)
+                with storage.open(file._variant_key(variant), "wb") as target:
+                    resized.save(target, "WEBP", quality=80)
+            file.variants = list(IMAGE_VARIANTS)
+            db.commit()
+
+    @classmethod
+    def compress_all(cls, batch_size: int = 500) -> None:
+        """Compresses all files that were stored before their media type got a storage encoding."""
+        last_id = None
+        while True:
+            with SessionLocal() as db:
+                filters: list[ColumnElement[bool]] = [cls.encoding.is_(None)]
+                if last_id is not None:
+                    filters.append(cls.id > last_id)
+                files = db.scalars(select(cls).where(*filters).order_by(cls.id).limit(batch_size)).all()
+                if not files:
+                    return
+                old_keys = [key for file in files if (key := file.compress()) is not None]
+                last_id = files[-1].id
+                db.commit()
+            storage = get_storage()
+            for key in old_keys:
+                storage.remove(key)
 
 
 @listens_for(File, "after_insert")
@@ -308,21 +579,78 @@ def delete_file(_mapper: Any, _connection: Any, target: File):
     inspector.session.info.setdefault("deleted_files", []).append(target)
 
 
+@listens_for(SessionLocal, "after_flush")
+def flush_principals(db: Session, _context: Any):
+    if any(isinstance(obj, (User, UserSettings, Team)) for obj in (*db.new, *db.dirty, *db.deleted)):
+        db.info["principals_changed"] = True
+
+
 @listens_for(SessionLocal, "after_commit")
-def commit_files(db: Session):
-    for file in db.info.get("new_files", []):
+def commit_principals(db: Session):
+    if db.info.pop("principals_changed", False):
+        Principal.invalidate()
+
+
+@listens_for(SessionLocal, "after_flush")
+def flush_cached_entities(db: Session, _context: Any):
+    changed = db.info.setdefault("cached_entities_changed", set())
+    changed.update((type(obj), obj.id) for obj in (*db.dirty, *db.deleted) if type(obj) in entity_cache.types)
+
+
+@listens_for(SessionLocal, "after_commit")
+def commit_cached_entities(db: Session):
+    entity_cache.evict(db.info.pop("cached_entities_changed", ()))
+
+
+def store_files(db: Session) -> None:
+    """Saves and removes the contents of the files that were added to or deleted from the database."""
+    for file in db.info.pop("new_files", []):
         assert isinstance(file, File)
         file.save()
-    for file in db.info.get("deleted_files", []):
+    for file in db.info.pop("deleted_files", []):
         assert isinstance(file, File)
         file.remove()
 
 
+@listens_for(SessionLocal, "after_commit")
+def commit_files(db: Session):
+    if not db.info.get("defer_file_io"):
+        store_files(db)
+
+
+async def commit_async(db: AsyncSession) -> None:
+    """Commits the session and then does the storage io of its files in the threadpool.
+
+    The commit hooks of async sessions run on the event loop, which the storage must not block since it may even need
+    to access the network.
+    """
+    db.info["defer_file_io"] = True
+    try:
+        await db.commit()
+    finally:
+        del db.info["defer_file_io"]
+    await run_in_threadpool(store_files, db.sync_session)
+
+
 def encode(col: Iterable[Base]) -> dict[ID, Any]:
     """Encodes a collection of database items into a jsonable container."""
     return {el.id: el.encode() for el in col}
 
 
+@dataclass(frozen=True)
+class CachedSettings:
+    """Read only copy of the server settings."""
+
+    id: ID
+    version: int
+    secret_key: bytes
+    email_config: EmailConfig
+    user_change_email: bool
+    team_change_name: bool
+    upload_file_limit: int
+    home_page_compiled: str | None
+
+
 class ServerSettings(Base, kw_only=True):
     """Singleton table for server wide settings."""
 
@@ -335,6 +663,13 @@ class ServerSettings(Base, kw_only=True):
 
     home_page_id: Mapped[UUID | None] = mapped_column(ForeignKey("files.id"), init=False)
     home_page_compiled: Mapped[strText | None] = mapped_column(default=None)
+    version: Mapped[int] = mapped_column(init=False)
+
+    __mapper_args__ = {"version_id_col": version}
+
+    check_interval: ClassVar[float] = 5
+    _cache: ClassVar[CachedSettings | None] = None
+    _next_check: ClassVar[float] = 0
 
     @classmethod
     def get(cls, db: Session) -> Self:
@@ -343,6 +678,51 @@ class ServerSettings(Base, kw_only=True):
             raise RuntimeError
         return obj
 
+    @classmethod
+    def cached(cls, db: Session) -> CachedSettings:
+        """Gets the settings without querying the database in most cases.
+
+        Every update increments the settings' version, other processes notice changes by checking it every few seconds.
+        """
+        now = monotonic()
+        cache = cls._cache
+        if cache is not None and now < cls._next_check:
+            return cache
+        if cache is None or db.scalar(select(cls.version)) != cache.version:
+            settings = cls.get(db)
+            cache = CachedSettings(
+                id=settings.id,
+                version=settings.version,
+                secret_key=settings.secret_key,
+                email_config=settings.email_config.model_copy(),
+                user_change_email=settings.user_change_email,
+                team_change_name=settings.team_change_name,
+                upload_file_limit=settings.upload_file_limit,
+                home_page_compiled=settings.home_page_compiled,
+            )
+            cls._cache = cache
+        cls._next_check = now + cls.check_interval
+        return cache
+
+    @classmethod
+    def get_secret_key(cls, db: Session) -> bytes:
+        """The key used to sign tokens."""
+        return cls.cached(db).secret_key
+
+
+@listens_for(ServerSettings, "after_update")
+def update_server_settings(_mapper: Any, _connection: Any, target: ServerSettings):
+    inspector = inspect(target)
+    assert inspector is not None
+    assert inspector.session is not None
+    inspector.session.info["settings_changed"] = True
+
+
+@listens_for(SessionLocal, "after_commit")
+def commit_server_settings(db: Session):
+    if db.info.pop("settings_changed", False):
+        ServerSettings._cache = None
+
 
 team_members = Table(
     "team_members",
@@ -355,8 +735,8 @@ team_members = Table(
 class UserSettings(Base):
     """Settings for each user."""
 
-    selected_team: Mapped["Team | None"] = relationship(lazy="joined", default=None)
-    selected_tournament: "Mapped[Tournament | None]" = relationship(lazy="joined", default=None)
+    selected_team: Mapped["Team | None"] = relationship(default=None)
+    selected_tournament: "Mapped[Tournament | None]" = relationship(default=None)
 
     selected_team_id: Mapped[UUID | None] = mapped_column(ForeignKey("teams.id"), init=False)
     selected_tournament_id: Mapped[UUID | None] = mapped_column(ForeignKey("tournaments.id"), init=False)
@@ -373,7 +753,7 @@ class User(Base):
     settings: Mapped[UserSettings] = relationship(default_factory=UserSettings)
 
     teams: Mapped[list["Team"]] = relationship(
-        secondary=team_members, back_populates="members", lazy="joined", default_factory=list
+        secondary=team_members, back_populates="members", default_factory=list
     )
     token_id: Mapped[ID] = mapped_column(default_factory=uuid4, init=False)
     settings_id: Mapped[UUID] = mapped_column(ForeignKey("usersettingss.id"), init=False)
@@ -414,35 +794,41 @@ class User(Base):
             "token_id": self.token_id.hex,
             "exp": datetime.now() + timedelta(weeks=4),
         }
-        return jwt.encode(payload, ServerSettings.get(db).secret_key, "HS256")
+        return jwt.encode(payload, ServerSettings.get_secret_key(db), "HS256")
 
     @classmethod
-    def decode_token(cls, db: Session, token: str | None) -> Self | None:
+    def _decode_token_ids(cls, db: Session, token: str | None) -> tuple[ID, ID] | None:
         if token is None:
             return
         try:
-            payload = jwt.decode(token, ServerSettings.get(db).secret_key, "HS256")
+            payload = jwt.decode(token, ServerSettings.get_secret_key(db), "HS256")
             if payload["type"] == "user":
-                user_id = UUID(cast(str, payload["user_id"]))
-                token_id = UUID(cast(str, payload["token_id"]))
-                user = cls.get(db, user_id)
-                if user is not None and user.token_id == token_id:
-                    return user
+                return UUID(cast(str, payload["user_id"])), UUID(cast(str, payload["token_id"]))
         except (JWTError, ExpiredSignatureError, NameError):
             return
 
+    @classmethod
+    def decode_token(cls, db: Session, token: str | None) -> Self | None:
+        ids = cls._decode_token_ids(db, token)
+        if ids is None:
+            return
+        user_id, token_id = ids
+        user = cls.get(db, user_id)
+        if user is not None and user.token_id == token_id:
+            return user
+
     def login_token(self, db: Session, lifetime: timedelta = timedelta(hours=1)) -> str:
         payload = {
             "type": "login",
             "email": self.email,
             "exp": datetime.now() + lifetime,
         }
-        return jwt.encode(payload, ServerSettings.get(db).secret_key, "HS256")
+        return jwt.encode(payload, ServerSettings.get_secret_key(db), "HS256")
 
     @classmethod
     def decode_login_token(cls, db: Session, token: str) -> Self:
         try:
-            payload = jwt.decode(token, ServerSettings.get(db).secret_key, "HS256")
+            payload = jwt.decode(token, ServerSettings.get_secret_key(db), "HS256")
             if payload["type"] == "login":
                 user = cls.get(db, cast(str, payload["email"]))
                 if user is not None:
@@ -452,6 +838,66 @@ class User(Base):
         raise ValueError
 
 
+@dataclass(frozen=True)
+class Principal:
+    """The data about a logged in user that most requests need.
+
+    Loading it only takes a single query selecting a few columns, and recently used principals are cached per token
+    so most requests don't need to query anything. Commits that change users, teams, or their settings clear the cache.
+    """
+
+    user_id: ID
+    is_admin: bool
+    team: TeamRef | None
+    tournament_id: ID | None
+
+    ttl: ClassVar[float] = 10
+    _cache: ClassVar[dict[ID, tuple[float, "Principal"]]] = {}
+
+    @property
+    def logged_in(self) -> TeamRef | Literal["admin"] | None:
+        if self.team is not None:
+            return self.team
+        elif self.is_admin:
+            return "admin"
+        else:
+            return None
+
+    @classmethod
+    def from_token(cls, db: Session, token: str | None) -> Self | None:
+        """Gets the principal of the user the token belongs to."""
+        ids = User._decode_token_ids(db, token)
+        if ids is None:
+            return None
+        user_id, token_id = ids
+        cached = cls._cache.get(token_id)
+        if cached is not None and cached[0] > monotonic():
+            return cast(Self, cached[1])
+
+        row = db.execute(
+            select(User.is_admin, UserSettings.selected_team_id, Team.tournament_id, UserSettings.selected_tournament_id)
+            .join(UserSettings, User.settings_id == UserSettings.id)
+            .outerjoin(Team, UserSettings.selected_team_id == Team.id)
+            .where(User.id == user_id, User.token_id == token_id)
+        ).first()
+        if row is None:
+            return None
+        is_admin, team_id, team_tournament_id, selected_tournament_id = row
+        if team_id is not None:
+            principal = cls(user_id, is_admin, TeamRef(team_id, team_tournament_id), team_tournament_id)
+        else:
+            principal = cls(user_id, is_admin, None, selected_tournament_id if is_admin else None)
+        if len(cls._cache) > 10_000:
+            cls._cache.clear()
+        cls._cache[token_id] = (monotonic() + cls.ttl, principal)
+        return principal
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """Clears the cache of principals."""
+        cls._cache.clear()
+
+
 class Tournament(Base, PermissionCheck):
     name: Mapped[str32] = mapped_column(unique=True)
     time: Mapped[datetime] = mapped_column(default_factory=datetime.now, init=False)
@@ -464,15 +910,15 @@ class Tournament(Base, PermissionCheck):
     def get(cls, db: Session, identifier: str | ID) -> Self | None:
         """Queries the database for the tournament with the given id or name."""
         if isinstance(identifier, UUID):
-            return db.get(cls, identifier)
+            return entity_cache.get(db, cls, identifier)
         else:
             return db.scalars(select(cls).filter(cls.name == identifier)).first()
 
-    def _visible(self, team: "Team") -> bool:
+    def _visible(self, team: TeamLike) -> bool:
         return team.tournament_id == self.id
 
     @classmethod
-    def _visible_sql(cls, team: "Team") -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return Tournament.id == team.tournament_id
 
 
@@ -484,10 +930,10 @@ class TeamSettings(Base):
 
 class Team(Base):
     name: Mapped[str32]
-    tournament: Mapped[Tournament] = relationship(back_populates="teams", uselist=False, lazy="joined")
+    tournament: Mapped[Tournament] = relationship(back_populates="teams", uselist=False)
     tournament_id: Mapped[ID] = mapped_column(ForeignKey("tournaments.id"), init=False)
     members: Mapped[list[User]] = relationship(
-        secondary=team_members, back_populates="teams", lazy="joined", default_factory=list
+        secondary=team_members, back_populates="teams", default_factory=list
     )
     settings: Mapped[TeamSettings] = relationship(default_factory=TeamSettings)
     settings_id: Mapped[UUID] = mapped_column(ForeignKey("teamsettingss.id"), init=False)
@@ -515,7 +961,7 @@ class Team(Base):
     def get(cls, db: Session, identifier: str | ID, tournament: Tournament | None = None) -> Self | None:
         """Queries the database for the team with the given id or name and tournament."""
         if isinstance(identifier, UUID):
-            return db.get(cls, identifier)
+            return entity_cache.get(db, cls, identifier)
         else:
             if tournament is None:
                 raise ValueError("If the team is given by its name, you have to specify a tournament!")
@@ -541,32 +987,75 @@ class Problem(Base, PermissionCheck):
     )
     colour: Mapped[str] = mapped_column(String(7), default="#FFFFFF")
     page_data: Mapped[ProblemPageData | None] = mapped_column(default=None)
+    # hash of the archive contents the page data was computed from
+    file_hash: Mapped[str64 | None] = mapped_column(default=None)
 
-    __table_args__ = (UniqueConstraint("name", "tournament_id"),)
+    __table_args__ = (
+        UniqueConstraint("name", "tournament_id"),
+        Index("ix_problems_tournament_start", "tournament_id", "start"),
+        Index("ix_problems_file_hash", "file_hash"),
+    )
     Schema = schemas.Problem
 
     @property
     def link(self) -> str:
         return f"/problems/{self.tournament.name}/{self.name}"
 
-    def _visible(self, team: Team) -> bool:
-        return team.tournament == self.tournament and (self.start is None or self.start <= datetime.now())
+    def _visible(self, team: TeamLike) -> bool:
+        return team.tournament_id == self.tournament_id and (self.start is None or self.start <= datetime.now())
 
     @classmethod
-    def _visible_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return (Problem.tournament_id == team.tournament_id) & (Problem.start.is_(None) | (Problem.start <= datetime.now()))
 
-    def _editable(self, team: Team) -> bool:
+    def _editable(self, team: TeamLike) -> bool:
         return (self.end is None or self.end >= datetime.now())
 
     @classmethod
-    def _editable_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _editable_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return Problem.end.is_(None) | Problem.end >= datetime.now()
 
-    def compute_page_data(self) -> None:
-        """Prepares the problem for further use, installing dependencies and computing the page data table."""
+    @staticmethod
+    def cached_page_data(db: Session, file_hash: str) -> ProblemPageData | None:
+        """Page data that was already computed for an identical problem archive."""
+        return db.scalars(
+            select(Problem.page_data).where(Problem.file_hash == file_hash, Problem.page_data.is_not(None)).limit(1)
+        ).first()
+
+    def use_file(self, db: Session, file: File) -> bool:
+        """Sets the problem's archive, and its page data if it is already known.
+
+        Returns whether the page data still needs to be computed.
+        """
+        file_hash = file.digest()
+        self.file = file
+        if file_hash != self.file_hash:
+            # the previous archive's page data must not be shown until the new one's has been computed
+            self.page_data = self.cached_page_data(db, file_hash)
+            self.file_hash = file_hash if self.page_data is not None else None
+        return self.page_data is None
+
+    @classmethod
+    def compute_page_data(cls, id: ID) -> None:
+        """Prepares the problem for further use, installing dependencies and computing the page data table.
+
+        Archives that have been processed before reuse the stored page data.
+        """
+        # the match code is only needed here, importing it lazily keeps it out of the web server's startup and memory
+        from algobattle.match import AlgobattleConfig
+
         with SessionLocal() as db, TempDir() as folder:
-            problem = db.merge(self)
+            # loaded in the session that writes the page data so that only it is updated, not any other columns
+            problem = db.get(cls, id)
+            if problem is None:
+                return
+            file_hash = problem.file.digest()
+            if problem.file_hash == file_hash and problem.page_data is not None:
+                return
+            if (page_data := cls.cached_page_data(db, file_hash)) is not None:
+                problem.page_data, problem.file_hash = page_data, file_hash
+                db.commit()
+                return
             with ZipFile(problem.file.path, "r") as spec:
                 spec.extractall(folder)
             config = AlgobattleConfig.from_file(folder)
@@ -587,13 +1076,17 @@ class Problem(Base, PermissionCheck):
                 instance_schema=config.loaded_problem.instance_cls.io_schema(),
                 solution_schema=config.loaded_problem.solution_cls.io_schema(),
             )
+            problem.file_hash = file_hash
             db.commit()
 
 
+entity_cache = EntityCache(Tournament, Team, Problem)
+
+
 class Report(Base, PermissionCheck):
-    team: Mapped[Team] = relationship(lazy="joined")
+    team: Mapped[Team] = relationship()
     team_id: Mapped[ID] = mapped_column(ForeignKey("teams.id"), init=False)
-    problem: Mapped[Problem] = relationship(lazy="joined")
+    problem: Mapped[Problem] = relationship()
     problem_id: Mapped[ID] = mapped_column(ForeignKey("problems.id"), init=False)
     file: Mapped[File] = relationship(cascade="all, delete-orphan", single_parent=True, lazy="selectin")
     file_id: Mapped[ID] = mapped_column(ForeignKey("files.id"), init=False)
@@ -601,47 +1094,49 @@ class Report(Base, PermissionCheck):
     __table_args__ = (UniqueConstraint("team_id", "problem_id"),)
     Schema = schemas.Report
 
-    def _visible(self, team: Team) -> bool:
-        return self.team == team and self.problem.visible(team)
+    def _visible(self, team: TeamLike) -> bool:
+        return self.team_id == team.id and self.problem.visible(team)
 
     @classmethod
-    def _visible_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return (Report.team_id == team.id) & Report.problem.has(Problem.visible_sql(team))
 
-    def _editable(self, team: Team) -> bool:
+    def _editable(self, team: TeamLike) -> bool:
         return self.problem._editable(team)
 
     @classmethod
-    def _editable_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _editable_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return Report.problem.has(Problem._editable_sql(team))
 
 
 class Program(Base, PermissionCheck):
     name: Mapped[str32]
-    team: Mapped[Team] = relationship(lazy="joined")
+    team: Mapped[Team] = relationship()
     team_id: Mapped[UUID] = mapped_column(ForeignKey("teams.id"), init=False)
     role: Mapped[ProgramRole]
     file: Mapped[File] = relationship(cascade="all, delete-orphan", single_parent=True, lazy="selectin")
     file_id: Mapped[ID] = mapped_column(ForeignKey("files.id"), init=False)
-    problem: Mapped[Problem] = relationship(lazy="joined")
+    problem: Mapped[Problem] = relationship()
     problem_id: Mapped[UUID] = mapped_column(ForeignKey("problems.id"), init=False)
     creation_time: Mapped[datetime] = mapped_column(default_factory=datetime.now)
     user_editable: Mapped[bool] = mapped_column(default=True)
 
+    # used to find the latest program of each team when running matches
+    __table_args__ = (Index("ix_programs_team_problem_role_time", "team_id", "problem_id", "role", "creation_time"),)
     Schema = schemas.Program
 
-    def _visible(self, team: Team) -> bool:
-        return self.team == team
+    def _visible(self, team: TeamLike) -> bool:
+        return self.team_id == team.id
 
     @classmethod
-    def _visible_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return Program.team_id == team.id
 
-    def _editable(self, team: Team) -> bool:
+    def _editable(self, team: TeamLike) -> bool:
         return self.user_editable and self.problem._editable(team)
 
     @classmethod
-    def _editable_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _editable_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return Program.user_editable & Program.problem.has(Problem._editable_sql(team))
 
 
@@ -649,7 +1144,7 @@ class ScheduledMatch(Base):
     __tablename__ = "scheduledmatches"  # type: ignore
     Schema = schemas.ScheduledMatch
 
-    time: Mapped[datetime]
+    time: Mapped[datetime] = mapped_column(index=True)
     problem: Mapped[Problem] = relationship()
     problem_id: Mapped[ID] = mapped_column(ForeignKey("problems.id"), init=False)
     name: Mapped[str32] = mapped_column(default="")
@@ -684,13 +1179,14 @@ class MatchResult(Base, PermissionCheck):
         default=None, foreign_keys=logs_id, cascade="all, delete-orphan", single_parent=True, lazy="selectin"
     )
 
+    __table_args__ = (Index("ix_matchresults_problem_time", "problem_id", "time"),)
     Schema = schemas.MatchResult
 
-    def _visible(self, team: Team) -> bool:
-        return any(team == p.team for p in self.participants)
+    def _visible(self, team: TeamLike) -> bool:
+        return any(team.id == p.team_id for p in self.participants)
 
     @classmethod
-    def _visible_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return MatchResult.participants.any(ResultParticipant.team_id == team.id)
 
 
@@ -706,16 +1202,38 @@ class ExtraPoints(Base, PermissionCheck):
 
     team_id: Mapped[ID] = mapped_column(ForeignKey("teams.id"), init=False)
 
-    def _visible(self, team: Team) -> bool:
-        return team.tournament == self.team.tournament
+    __table_args__ = (Index("ix_extrapoints_team_time", "team_id", "time"),)
+
+    def _visible(self, team: TeamLike) -> bool:
+        return team.tournament_id == self.team.tournament_id
 
     @classmethod
-    def _visible_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _visible_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return ExtraPoints.team.has(Team.tournament_id == team.tournament_id)
     
-    def _editable(self, team: Team) -> bool:
+    def _editable(self, team: TeamLike) -> bool:
         return False
 
     @classmethod
-    def _editable_sql(cls, team: Team) -> ColumnElement[bool]:
+    def _editable_sql(cls, team: TeamLike) -> ColumnElement[bool]:
         return sql_false()
+
+
+class Job(Base):
+    """A task run by the background worker."""
+
+    kind: Mapped[JobKind]
+    args: Mapped[dict[str, Any]] = mapped_column(JSON)
+    # pending jobs with the same key are only run once
+    key: Mapped[str256]
+    status: Mapped[JobStatus] = mapped_column(default=JobStatus.pending)
+    attempts: Mapped[int] = mapped_column(default=0)
+    max_attempts: Mapped[int] = mapped_column(default=3)
+    created: Mapped[datetime] = mapped_column(default_factory=datetime.now)
+    run_after: Mapped[datetime] = mapped_column(default_factory=datetime.now)
+    started: Mapped[datetime | None] = mapped_column(default=None)
+    finished: Mapped[datetime | None] = mapped_column(default=None)
+    error: Mapped[strText | None] = mapped_column(default=None)
+
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"), Index("ix_jobs_key", "key"))
+    Schema = schemas.Job
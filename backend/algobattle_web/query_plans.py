@@ -0,0 +1,305 @@
+"""Checks that the frequently run queries are answered using indexes.
+
+The check creates a scratch database, fills it with a dataset of the size of several runs of the course and asks the database
+for the execution plan of each query. It fails if one of them has to scan a whole table, and warns if it uses a
+different index than the one that was added for it. Run it against the database server of the deployment with
+
+    python -m algobattle_web.query_plans
+
+or against any other database by passing its url with `--db-url`. The scratch database is dropped afterwards.
+"""
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from random import Random
+from typing import Any, Iterator
+from uuid import UUID, uuid4
+
+from sqlalchemy import Engine, Select, create_engine, func, insert, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy_utils.functions import create_database, database_exists, drop_database
+
+from algobattle.util import Role
+from algobattle_web.models import (
+    Base,
+    ExtraPoints,
+    File,
+    MatchResult,
+    Problem,
+    Program,
+    ResultParticipant,
+    ScheduledMatch,
+    Team,
+    TeamSettings,
+    Tournament,
+)
+from algobattle_web.util import EnvConfig, MatchStatus
+
+
+@dataclass
+class Dataset:
+    """Size of the seeded dataset."""
+
+    tournaments: int = 10
+    teams: int = 20
+    problems: int = 10
+    programs: int = 10
+    results: int = 100
+    extra_points: int = 20
+    scheduled: int = 50
+
+
+@dataclass
+class Seeded:
+    """Ids of some seeded objects the checked queries filter by."""
+
+    tournament: UUID
+    team: UUID
+    problem: UUID
+
+
+def _rows(count: int, factory: Any) -> list[dict[str, Any]]:
+    return [factory(i) for i in range(count)]
+
+
+def seed(engine: Engine, size: Dataset, rng: Random) -> Seeded:
+    """Fills an empty database with randomly generated data."""
+    now = datetime.now()
+    with engine.begin() as conn:
+
+        def file(i: int) -> dict[str, Any]:
+            return {
+                "id": uuid4(),
+                "filename": f"{i}.zip",
+                "media_type": "application/zip",
+                "alt_text": "",
+                "timestamp": now,
+                "variants": [],
+            }
+
+        tournaments = _rows(size.tournaments, lambda i: {"id": uuid4(), "name": f"tournament {i}", "time": now})
+        conn.execute(insert(Tournament), tournaments)
+        teams, problems = [], []
+        for tournament in tournaments:
+            settings = _rows(size.teams, lambda _: {"id": uuid4()})
+            conn.execute(insert(TeamSettings), settings)
+            teams += [
+                {"id": uuid4(), "name": f"team {i}", "tournament_id": tournament["id"], "settings_id": s["id"]}
+                for i, s in enumerate(settings)
+            ]
+            files = _rows(size.problems, file)
+            conn.execute(insert(File), files)
+            problems += [
+                {
+                    "id": uuid4(),
+                    "name": f"problem {i}",
+                    "tournament_id": tournament["id"],
+                    "file_id": f["id"],
+                    "start": now - timedelta(days=rng.randint(-10, 60)),
+                }
+                for i, f in enumerate(files)
+            ]
+        conn.execute(insert(Team), teams)
+        conn.execute(insert(Problem), problems)
+        problems_of = {t["id"]: [p for p in problems if p["tournament_id"] == t["id"]] for t in tournaments}
+
+        programs = []
+        for team in teams:
+            for problem in problems_of[team["tournament_id"]]:
+                for role in Role:
+                    files = _rows(size.programs, file)
+                    conn.execute(insert(File), files)
+                    programs += [
+                        {
+                            "id": uuid4(),
+                            "name": "",
+                            "team_id": team["id"],
+                            "role": role,
+                            "file_id": f["id"],
+                            "problem_id": problem["id"],
+                            "creation_time": now - timedelta(minutes=rng.randint(0, 10**5)),
+                            "user_editable": True,
+                        }
+                        for f in files
+                    ]
+        conn.execute(insert(Program), programs)
+
+        results, participants = [], []
+        for problem in problems:
+            entrants = [t for t in teams if t["tournament_id"] == problem["tournament_id"]]
+            for _ in range(size.results):
+                result = {
+                    "id": uuid4(),
+                    "status": MatchStatus.complete,
+                    "problem_id": problem["id"],
+                    "time": now - timedelta(minutes=rng.randint(0, 10**5)),
+                }
+                results.append(result)
+                participants += [
+                    {"match_id": result["id"], "team_id": t["id"], "points": rng.random() * 100}
+                    for t in rng.sample(entrants, 2)
+                ]
+        conn.execute(insert(MatchResult), results)
+        conn.execute(insert(ResultParticipant), participants)
+        conn.execute(
+            insert(ExtraPoints),
+            [
+                {
+                    "id": uuid4(),
+                    "time": now - timedelta(minutes=rng.randint(0, 10**5)),
+                    "tag": "bonus",
+                    "team_id": team["id"],
+                    "points": 1,
+                    "description": "",
+                }
+                for team in teams
+                for _ in range(size.extra_points)
+            ],
+        )
+        conn.execute(
+            insert(ScheduledMatch),
+            [
+                {
+                    "id": uuid4(),
+                    "time": now + timedelta(minutes=rng.randint(-(10**4), 10**4)),
+                    "problem_id": rng.choice(problems)["id"],
+                    "name": "",
+                    "points": 100,
+                }
+                for _ in range(size.scheduled)
+            ],
+        )
+        if engine.dialect.name == "mysql":
+            for table in Base.metadata.sorted_tables:
+                conn.execute(text(f"ANALYZE TABLE {table.name}"))
+        elif engine.dialect.name == "sqlite":
+            conn.execute(text("ANALYZE"))
+    team = teams[0]
+    return Seeded(tournament=team["tournament_id"], team=team["id"], problem=problems_of[team["tournament_id"]][0]["id"])
+
+
+@dataclass
+class Check:
+    """A query and the index it should be using to access a table."""
+
+    name: str
+    query: Select[Any]
+    table: str
+    index: str
+
+
+def checks(seeded: Seeded) -> Iterator[Check]:
+    """The checked queries, each mirroring the one run by the named endpoint or task."""
+    now = datetime.now()
+    yield Check(
+        "battle.run_match",
+        select(Program)
+        .where(Program.team_id == seeded.team, Program.problem_id == seeded.problem, Program.role == Role.generator)
+        .order_by(Program.creation_time.desc())
+        .limit(1),
+        "programs",
+        "ix_programs_team_problem_role_time",
+    )
+    yield Check(
+        "battle.main",
+        select(ScheduledMatch).where(now - timedelta(minutes=1) <= ScheduledMatch.time, ScheduledMatch.time <= now),
+        "scheduledmatches",
+        "ix_scheduledmatches_time",
+    )
+    yield Check(
+        "api.results",
+        select(MatchResult).where(MatchResult.problem_id == seeded.problem),
+        "matchresults",
+        "ix_matchresults_problem_time",
+    )
+    yield Check(
+        "api.get_scores",
+        select(MatchResult).where(
+            MatchResult.problem_id.in_(select(Problem.id).where(Problem.tournament_id == seeded.tournament)),
+            MatchResult.participants.any(ResultParticipant.points != 0),
+        ),
+        "matchresults",
+        "ix_matchresults_problem_time",
+    )
+    yield Check(
+        "api.get_scores",
+        select(ExtraPoints).where(
+            ExtraPoints.team_id.in_(select(Team.id).where(Team.tournament_id == seeded.tournament))
+        ),
+        "extrapoints",
+        "ix_extrapoints_team_time",
+    )
+    yield Check(
+        "api.get_problems",
+        select(Problem).where(Problem.tournament_id == seeded.tournament, Problem.start <= now),
+        "problems",
+        "ix_problems_tournament_start",
+    )
+    yield Check(
+        "api.search_program",
+        select(func.count()).select_from(Program).where(Program.team_id == seeded.team),
+        "programs",
+        "ix_programs_team_problem_role_time",
+    )
+
+
+def used_index(engine: Engine, query: Select[Any], table: str) -> str | None:
+    """The index used to access the table, or `None` if the whole table is scanned."""
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            for *_, detail in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"):
+                words = detail.split()
+                if len(words) < 2 or words[1] != table:
+                    continue
+                if "INDEX" in words:
+                    return words[words.index("INDEX") + 1]
+                if "PRIMARY" in words:
+                    return "PRIMARY"
+            return None
+        else:
+            for row in conn.exec_driver_sql(f"EXPLAIN {sql}").mappings():
+                if row["table"] == table and row["type"] != "ALL":
+                    return row["key"]
+            return None
+
+
+def main() -> None:
+    """Seeds a scratch database and checks the plans of all hot queries."""
+    parser = ArgumentParser(description="Checks that the hot queries are answered using indexes.")
+    parser.add_argument("--db-url", help="Url of the scratch database, defaults to one on the configured server.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database afterwards.")
+    args = parser.parse_args()
+
+    if args.db_url:
+        url = make_url(args.db_url)
+    else:
+        url = make_url(EnvConfig.get().db_url).set(database="algobattle_query_plans")
+    if database_exists(url):
+        raise SystemExit(f"The database {url.database} already exists, refusing to seed it")
+    create_database(url)
+    engine = create_engine(url)
+    try:
+        Base.metadata.create_all(engine)
+        seeded = seed(engine, Dataset(), Random(args.seed))
+        failed = False
+        for check in checks(seeded):
+            index = used_index(engine, check.query, check.table)
+            if index is None:
+                failed = True
+                print(f"FAIL {check.name}: scans all of {check.table}")
+            elif index != check.index:
+                print(f"WARN {check.name}: uses {index} instead of {check.index}")
+            else:
+                print(f"OK   {check.name}: uses {index}")
+    finally:
+        engine.dispose()
+        if not args.keep:
+            drop_database(url)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
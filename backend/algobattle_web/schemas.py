@@ -1,13 +1,13 @@
 """Module containing db model's schemas to avoid namespacing issues."""
 from abc import ABC
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Any
 from urllib.parse import quote as urlencode
 from uuid import UUID
 
 from pydantic import ByteSize, Field, PlainSerializer, computed_field, field_validator
 
-from algobattle_web.util import BaseSchema, EmailConfig, EnvConfig, MatchStatus, ObjID
+from algobattle_web.util import BaseSchema, EmailConfig, EnvConfig, JobKind, JobStatus, MatchStatus, ObjID
 from algobattle.util import Role
 
 
@@ -32,12 +32,18 @@ class DbFile(Base):
     media_type: str
     timestamp: LocalDatetime
     alt_text: str
+    variants: list[str] = []
 
     @computed_field
     @property
     def location(self) -> str:
         return f"{EnvConfig.get().base_url}/api/files/{urlencode(str(self.id))}"
 
+    @computed_field
+    @property
+    def variant_locations(self) -> dict[str, str]:
+        return {variant: f"{self.location}?variant={urlencode(variant)}" for variant in self.variants}
+
 
 class Tournament(Base):
     name: str
@@ -102,6 +108,14 @@ class Problem(Base):
     # property is defined on db model to make it have access to the tournament name
     link: str
 
+    @computed_field
+    @property
+    def thumbnail(self) -> str | None:
+        """Location of a downscaled version of the image, falls back to the full image if there is none."""
+        if self.image is None:
+            return None
+        return self.image.variant_locations.get("thumbnail", self.image.location)
+
 
 class Report(Base):
     team: ObjID
@@ -109,16 +123,21 @@ class Report(Base):
     file: DbFile
 
 
-class Program(Base):
+class ProgramBase(Base):
+    """Fields shared by the full and normalized program schemas."""
+
     name: str
     team: ObjID
     role: Role
-    file: DbFile
     creation_time: LocalDatetime
     problem: ObjID
     user_editable: bool
 
 
+class Program(ProgramBase):
+    file: DbFile
+
+
 class ScheduledMatch(Base):
     name: str
     time: LocalDatetime
@@ -126,24 +145,67 @@ class ScheduledMatch(Base):
     points: float
 
 
-class ResultParticipant(BaseSchema):
+class ResultParticipantBase(BaseSchema):
+    """Fields shared by the full and normalized result participant schemas."""
+
     team_id: UUID
+    points: float
+
+
+class ResultParticipant(ResultParticipantBase):
     generator: Program | None = None
     solver: Program | None = None
-    points: float
 
 
-class MatchResult(Base):
+class MatchResultBase(Base):
+    """Fields shared by the full and normalized match result schemas."""
+
     status: MatchStatus
     time: LocalDatetime
     problem: ObjID
+
+
+class MatchResult(MatchResultBase):
     participants: list[ResultParticipant]
     logs: DbFile | None = None
 
 
+class NormalizedProgram(ProgramBase):
+    """Program that references its file by id."""
+
+    file: ObjID = Field(validation_alias="file_id")
+
+
+class NormalizedResultParticipant(ResultParticipantBase):
+    """Result participant that references its programs by id."""
+
+    generator: ObjID | None = Field(default=None, validation_alias="generator_id")
+    solver: ObjID | None = Field(default=None, validation_alias="solver_id")
+
+
+class NormalizedMatchResult(MatchResultBase):
+    """Match result that references its programs and files by id."""
+
+    participants: list[NormalizedResultParticipant]
+    logs: ObjID | None = Field(default=None, validation_alias="logs_id")
+
+
 class ExtraPoints(Base):
     time: LocalDatetime
     tag: str
     team: Team
     points: float
     description: str
+
+
+class Job(Base):
+    kind: JobKind
+    args: dict[str, Any]
+    status: JobStatus
+    attempts: int
+    max_attempts: int
+    created: LocalDatetime
+    run_after: LocalDatetime
+    started: LocalDatetime | None
+    finished: LocalDatetime | None
+    error: str | None
@@ -0,0 +1,278 @@
+"""Storage backends holding the contents of database files."""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from hashlib import sha256
+from io import BufferedIOBase
+from os import utime, walk
+from pathlib import Path
+from shutil import copyfile, move as move_file, rmtree
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile, gettempdir
+from time import monotonic
+from typing import Any, BinaryIO, ClassVar, Iterator, Literal, cast
+from urllib.parse import urlparse
+
+from algobattle_web.util import EnvConfig
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    """Information about a file present in a storage."""
+
+    key: str
+    size: int
+    modified: datetime
+
+
+class Storage(ABC):
+    """Interface of the places file contents can be kept in.
+
+    Files are identified by string keys, the storage does not know anything else about them.
+    """
+
+    @abstractmethod
+    def path(self, key: str) -> Path:
+        """A path on the local filesystem containing the file's contents.
+
+        Storages that need to fetch the contents first raise a `FileNotFoundError` if the file does not exist.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def open(self, key: str, mode: Literal["rb", "wb"] = "rb") -> BinaryIO:
+        """Opens a stream of the file's contents."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save(self, key: str, source: Path, *, move: bool = False) -> None:
+        """Stores the contents of a file on the local filesystem."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, key: str) -> None:
+        """Removes the file, does nothing if it does not exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Checks whether the file exists."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def entries(self) -> Iterator[StoredFile]:
+        """Lists all files in the storage."""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """Stores files in a directory on the local filesystem.
+
+    To keep directories small, files are spread over two levels of subdirectories named after the leading characters
+    of their key's hash. Files stored in the root directory itself by older versions are moved into their shard the
+    first time they are accessed.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def _location(self, key: str) -> Path:
+        digest = sha256(key.encode()).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / key
+
+    def path(self, key: str) -> Path:
+        location = self._location(key)
+        if not location.exists():
+            legacy = self.root / key
+            if legacy.is_file():
+                location.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    move_file(legacy, location)
+                except FileNotFoundError:
+                    # another process moved it first
+                    if not location.exists():
+                        raise
+        return location
+
+    def open(self, key: str, mode: Literal["rb", "wb"] = "rb") -> BinaryIO:
+        path = self.path(key)
+        if mode == "wb":
+            path.parent.mkdir(parents=True, exist_ok=True)
+        return cast(BinaryIO, open(path, mode))
+
+    def save(self, key: str, source: Path, *, move: bool = False) -> None:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            move_file(source, path)
+        else:
+            copyfile(source, path)
+
+    def remove(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def entries(self) -> Iterator[StoredFile]:
+        for dirpath, _, filenames in walk(self.root):
+            for name in filenames:
+                stat = Path(dirpath, name).stat()
+                yield StoredFile(name, stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+
+
+class _Upload(BufferedIOBase):
+    """Buffers written data and uploads it to the object store once it is closed."""
+
+    def __init__(self, storage: "ObjectStorage", key: str) -> None:
+        super().__init__()
+        self._buffer = SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        self._storage = storage
+        self._key = key
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        return self._buffer.write(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self._buffer.seek(0)
+                self._storage.client.upload_fileobj(self._buffer, self._storage.bucket, self._storage._object(self._key))
+            finally:
+                self._buffer.close()
+        super().close()
+
+
+class ObjectStorage(Storage):
+    """Stores files in an S3 compatible object store.
+
+    Any S3 compatible service can be used by specifying its `endpoint_url`, e.g. the `dev-storage` MinIO container
+    during development. Consumers that need a path on the local filesystem get a copy that is downloaded into the
+    `cache` directory. Copies are stored under the object's ETag so that changed or deleted objects aren't served from
+    a stale copy for longer than `revalidate_after` seconds, and the least recently used ones are evicted once the cache
+    grows beyond `cache_size` bytes.
+    """
+
+    revalidate_after: ClassVar[float] = 10
+
+    def __init__(
+        self, bucket: str, prefix: str = "", *, endpoint_url: str | None = None, cache: Path, cache_size: int
+    ) -> None:
+        import boto3
+
+        self.client: Any = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.cache = cache
+        self.cache_size = cache_size
+        # cached copies and when their ETag was last checked against the bucket
+        self._validated: dict[str, tuple[Path, float]] = {}
+
+    def _object(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _head(self, key: str) -> dict[str, Any] | None:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+        except self.client.exceptions.ClientError:
+            return None
+
+    def _drop_cached(self, key: str) -> None:
+        self._validated.pop(key, None)
+        rmtree(self.cache / key, ignore_errors=True)
+
+    def _evict(self) -> None:
+        copies = []
+        for dirpath, _, filenames in walk(self.cache):
+            for name in filenames:
+                # partial downloads of other processes must not be removed from under them
+                if name.startswith(".partial"):
+                    continue
+                try:
+                    stat = Path(dirpath, name).stat()
+                except FileNotFoundError:
+                    continue
+                copies.append((stat.st_mtime, stat.st_size, Path(dirpath, name)))
+        total = sum(size for _, size, _ in copies)
+        for _, size, path in sorted(copies):
+            if total <= self.cache_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def path(self, key: str) -> Path:
+        validated = self._validated.get(key)
+        if validated is not None and monotonic() - validated[1] < self.revalidate_after and validated[0].exists():
+            utime(validated[0])
+            return validated[0]
+        head = self._head(key)
+        if head is None:
+            self._drop_cached(key)
+            raise FileNotFoundError(key)
+        location = self.cache / key / head["ETag"].strip('"')
+        if location.exists():
+            # the modification time orders the copies for eviction
+            utime(location)
+            self._validated[key] = (location, monotonic())
+            return location
+        self._drop_cached(key)
+        location.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(dir=location.parent, prefix=".partial", delete=False) as partial:
+            try:
+                self.client.download_fileobj(self.bucket, self._object(key), partial)
+            except BaseException:
+                Path(partial.name).unlink(missing_ok=True)
+                raise
+        Path(partial.name).replace(location)
+        self._validated[key] = (location, monotonic())
+        self._evict()
+        return location
+
+    def open(self, key: str, mode: Literal["rb", "wb"] = "rb") -> BinaryIO:
+        if mode == "wb":
+            self._drop_cached(key)
+            return cast(BinaryIO, _Upload(self, key))
+        else:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object(key))["Body"]
+
+    def save(self, key: str, source: Path, *, move: bool = False) -> None:
+        self.client.upload_file(str(source), self.bucket, self._object(key))
+        self._drop_cached(key)
+        if move:
+            source.unlink()
+
+    def remove(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        self._drop_cached(key)
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def entries(self) -> Iterator[StoredFile]:
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield StoredFile(obj["Key"].removeprefix(prefix), obj["Size"], obj["LastModified"])
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> Storage:
+    """The storage backend configured by the `ALGOBATTLE_STORAGE` environment variable.
+
+    It either is a path to a local directory or an `s3://bucket/prefix` url.
+    """
+    config = EnvConfig.get()
+    url = urlparse(config.storage)
+    if url.scheme == "s3":
+        return ObjectStorage(
+            url.netloc,
+            url.path,
+            endpoint_url=config.storage_endpoint,
+            cache=Path(gettempdir()) / "algobattle_storage",
+            cache_size=config.storage_cache_size,
+        )
+    else:
+        return LocalStorage(Path(config.storage))
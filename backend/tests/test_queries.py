@@ -0,0 +1,160 @@
+"""Tests that the list endpoints load their related objects in a fixed number of queries."""
+from datetime import datetime
+from pathlib import Path
+from random import Random
+from typing import Iterator
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+
+from algobattle.util import Role
+from algobattle_web.cache import response_cache
+from algobattle_web.database import assert_max_queries, instrument
+from algobattle_web.models import (
+    Base,
+    File,
+    MatchResult,
+    Principal,
+    Problem,
+    Program,
+    Report,
+    ResultParticipant,
+    ServerSettings,
+    Team,
+    User,
+)
+from algobattle_web.query_plans import Dataset, Seeded, seed
+from algobattle_web.util import AsyncSessionLocal, SessionLocal, unwrap
+
+
+@pytest.fixture
+def seeded(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Seeded]:
+    """A sqlite database with enough data that loading related objects one at a time would show up in the counts."""
+    path = tmp_path / "db.sqlite"
+    engine = create_engine(f"sqlite:///{path}")
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    instrument(engine)
+    instrument(async_engine.sync_engine)
+    Base.metadata.create_all(engine)
+    data = seed(engine, Dataset(tournaments=2, teams=4, problems=3, programs=2, results=30, extra_points=2), Random(0))
+    with Session(engine) as db:
+        # the seeded results don't reference any programs, but loading those is what's most likely to regress
+        programs = {
+            (team, problem, role): id
+            for id, team, problem, role in db.execute(
+                select(Program.id, Program.team_id, Program.problem_id, Program.role)
+            )
+        }
+        participants = db.execute(
+            select(ResultParticipant.match_id, ResultParticipant.team_id, MatchResult.problem_id).join(
+                MatchResult, ResultParticipant.match_id == MatchResult.id
+            )
+        ).all()
+        db.execute(
+            update(ResultParticipant),
+            [
+                {
+                    "match_id": match,
+                    "team_id": team,
+                    "generator_id": programs[team, problem, Role.generator],
+                    "solver_id": programs[team, problem, Role.solver],
+                }
+                for match, team, problem in participants
+            ],
+        )
+        now = datetime.now()
+        files = [
+            {
+                "id": uuid4(),
+                "filename": f"{i}.pdf",
+                "media_type": "application/pdf",
+                "alt_text": "",
+                "timestamp": now,
+                "variants": [],
+            }
+            for i in range(3)
+        ]
+        db.execute(insert(File), files)
+        teams = db.scalars(select(Team.id).where(Team.tournament_id == data.tournament)).all()
+        problems = db.scalars(select(Problem.id).where(Problem.tournament_id == data.tournament)).all()
+        db.execute(
+            insert(Report),
+            [
+                {"id": uuid4(), "team_id": team, "problem_id": problem, "file_id": file["id"]}
+                for team, problem, file in zip(teams, problems, files)
+            ],
+        )
+        db.add_all([ServerSettings(), User(email="admin@example.com", name="admin", is_admin=True)])
+        db.commit()
+
+    SessionLocal.configure(bind=engine)
+    AsyncSessionLocal.configure(bind=async_engine)
+    # the caches are shared by the whole process and would otherwise keep data of other tests' databases
+    monkeypatch.setattr(ServerSettings, "_cache", None)
+    monkeypatch.setattr(ServerSettings, "_next_check", 0)
+    monkeypatch.setattr(ServerSettings, "check_interval", float("inf"))
+    Principal.invalidate()
+    response_cache.invalidate()
+    yield data
+    engine.dispose()
+
+
+@pytest.fixture
+def client(seeded: Seeded, monkeypatch: pytest.MonkeyPatch) -> TestClient:
+    """A test client logged in as an admin, without running the app's startup that connects to the real database."""
+    monkeypatch.setenv("ALGOBATTLE_DB_PW", "testing")
+    monkeypatch.setenv("ALGOBATTLE_BASE_URL", "http://localhost")
+    from algobattle_web.app import app
+
+    with SessionLocal() as db:
+        token = unwrap(User.get(db, "admin@example.com")).cookie(db)
+    return TestClient(app, headers={"X-User-Token": token})
+
+
+def test_results(client: TestClient):
+    with assert_max_queries(19):
+        response = client.get("/api/match/result")
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == 180
+
+
+def test_results_normalized(client: TestClient):
+    with assert_max_queries(16):
+        response = client.get("/api/match/result", params={"normalize": True})
+    assert response.status_code == 200
+    assert response.json()["programs"]
+
+
+def test_results_page(client: TestClient):
+    with assert_max_queries(19):
+        response = client.get("/api/match/result", params={"limit": 10})
+    data = response.json()
+    assert len(data["results"]) == 10
+    next_page = client.get("/api/match/result", params={"limit": 10, "cursor": data["next_cursor"]}).json()
+    assert not data["results"].keys() & next_page["results"].keys()
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_program_search(client: TestClient, normalize: bool):
+    with assert_max_queries(10):
+        response = client.get("/api/program", params={"normalize": normalize})
+    assert response.status_code == 200
+    assert response.json()["programs"]
+
+
+def test_scores(client: TestClient, seeded: Seeded):
+    with assert_max_queries(10):
+        response = client.get(f"/api/tournament/{seeded.tournament}/scores/")
+    assert response.status_code == 200
+    assert response.json()["events"]
+
+
+def test_reports(client: TestClient):
+    with assert_max_queries(9):
+        response = client.get("/api/report")
+    assert response.status_code == 200
+    assert len(response.json()["reports"]) == 3
@@ -0,0 +1,102 @@
+"""Tests for the storage backends."""
+from pathlib import Path
+from shutil import move
+from typing import Iterator
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from algobattle_web import storage
+from algobattle_web.storage import LocalStorage, ObjectStorage
+
+
+@pytest.fixture
+def object_storage(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[ObjectStorage]:
+    """An object storage backed by moto's in-memory S3 with a cache that fits two 10 byte files."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket="files")
+        yield ObjectStorage("files", "/prefix/", cache=tmp_path / "cache", cache_size=20)
+
+
+def write(storage: ObjectStorage, key: str, data: bytes) -> None:
+    with storage.open(key, "wb") as file:
+        file.write(data)
+
+
+def test_roundtrip(object_storage: ObjectStorage, tmp_path: Path):
+    write(object_storage, "a", b"0123456789")
+    source = tmp_path / "source"
+    source.write_bytes(b"abcdefghij")
+    object_storage.save("b", source, move=True)
+    assert not source.exists()
+    assert object_storage.open("a").read() == b"0123456789"
+    assert object_storage.path("b").read_bytes() == b"abcdefghij"
+    assert {(file.key, file.size) for file in object_storage.entries()} == {("a", 10), ("b", 10)}
+
+
+def test_path_reflects_changes(object_storage: ObjectStorage, monkeypatch: pytest.MonkeyPatch):
+    write(object_storage, "a", b"0123456789")
+    assert object_storage.path("a").read_bytes() == b"0123456789"
+    # another process replacing the object must not leave this one with its old contents once it revalidates
+    other = ObjectStorage("files", "prefix", cache=object_storage.cache.with_name("other"), cache_size=20)
+    write(other, "a", b"9876543210")
+    monkeypatch.setattr(object_storage, "revalidate_after", 0)
+    assert object_storage.path("a").read_bytes() == b"9876543210"
+
+
+def test_path_revalidation(object_storage: ObjectStorage, monkeypatch: pytest.MonkeyPatch):
+    write(object_storage, "a", b"0123456789")
+    object_storage.path("a")
+    heads = []
+    head = object_storage.client.head_object
+    monkeypatch.setattr(object_storage.client, "head_object", lambda **kwargs: heads.append(kwargs) or head(**kwargs))
+    object_storage.path("a")
+    assert heads == []
+    monkeypatch.setattr(object_storage, "revalidate_after", 0)
+    object_storage.path("a")
+    assert len(heads) == 1
+
+
+def test_exists_after_remote_removal(object_storage: ObjectStorage, monkeypatch: pytest.MonkeyPatch):
+    write(object_storage, "a", b"0123456789")
+    object_storage.path("a")
+    object_storage.client.delete_object(Bucket="files", Key="prefix/a")
+    assert not object_storage.exists("a")
+    monkeypatch.setattr(object_storage, "revalidate_after", 0)
+    with pytest.raises(FileNotFoundError):
+        object_storage.path("a")
+    assert not (object_storage.cache / "a").exists()
+
+
+def test_cache_eviction(object_storage: ObjectStorage):
+    for key in "abc":
+        write(object_storage, key, b"0123456789")
+        object_storage.path(key)
+    cached = {path.parent.name for path in object_storage.cache.rglob("*") if path.is_file()}
+    assert cached == {"b", "c"}
+    assert not any(path.name.startswith(".partial") for path in object_storage.cache.rglob("*"))
+
+
+def test_local_storage_legacy_layout(tmp_path: Path):
+    (tmp_path / "a").write_bytes(b"legacy")
+    local = LocalStorage(tmp_path)
+    assert local.exists("a")
+    assert local.path("a") != tmp_path / "a"
+    assert local.open("a").read() == b"legacy"
+    assert not (tmp_path / "a").exists()
+
+
+def test_local_storage_legacy_race(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (tmp_path / "a").write_bytes(b"legacy")
+
+    def move_first(source: Path, target: Path) -> None:
+        # another process moves the file between the check and this process' move
+        move(source, target)
+        raise FileNotFoundError(source)
+
+    monkeypatch.setattr(storage, "move_file", move_first)
+    assert LocalStorage(tmp_path).path("a").read_bytes() == b"legacy"